@@ -1,6 +1,6 @@
-import json
-from typing import Any
+from typing import Any, Sequence
 
+from app.config import settings
 from app.container import Container
 from app.workers.model_client import ModelClient
 
@@ -13,5 +13,24 @@ async def model_on_message(raw_message: Any, model_client: ModelClient = Contain
         "name": string,   # название
     }
     """
-    template_object = raw_message if isinstance(raw_message, dict) else json.loads(raw_message)
+    template_object = raw_message if isinstance(raw_message, dict) else model_client.codec.loads(raw_message)
     await model_client.inference(template_object)
+
+
+async def model_on_messages(raw_messages: Sequence[Any], model_client: ModelClient = Container.model_client()):
+    """
+    Пакетный вариант model_on_message: пачка сообщений скорится одним вызовом модели.
+    Протокол сообщения тот же, что и у model_on_message, сообщения сериализованы кодеком AMQP.codec
+    """
+    records = []
+    for raw_message in raw_messages:
+        try:
+            records.append(raw_message if isinstance(raw_message, dict) else model_client.codec.loads(raw_message))
+        except Exception as error:
+            model_client.logger.exception("Невалидное сообщение в очереди: %s", raw_message)
+            if model_client.retry_queue:
+                await model_client.retry_queue.dead_letter(
+                    settings.AMQP.routing_keys.model_manager_routing_key, raw_message, error
+                )
+    if records:
+        await model_client.batch_inference(records)
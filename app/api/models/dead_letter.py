@@ -0,0 +1,19 @@
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+
+class DeadLetterOut(BaseModel):
+    message: Any = Field(description="Исходное сообщение")
+    attempts: int = Field(description="Количество попыток обработки")
+    error: str = Field(description="Последняя ошибка обработки")
+    failed_at: float = Field(description="Время попадания в dead letter list, unix timestamp")
+
+
+class DeadLettersOut(BaseModel):
+    total: int = Field(description="Количество сообщений в dead letter list")
+    items: list[DeadLetterOut]
+
+
+class ReplayOut(BaseModel):
+    replayed: int = Field(description="Количество переотправленных сообщений")
@@ -1,6 +1,7 @@
 from datetime import date, datetime
+from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class PredictIn(BaseModel):
@@ -24,3 +25,10 @@ class PredictIn(BaseModel):
 
 class PredictOut(BaseModel):
     pred: float
+    model_version: str = Field(description="Версия модели, посчитавшая вероятность")
+
+
+class PredictBatchItemOut(BaseModel):
+    pred: Optional[float] = Field(default=None, description="Вероятность, если запись обработана")
+    model_version: Optional[str] = Field(default=None, description="Версия модели, посчитавшая вероятность")
+    error: Optional[str] = Field(default=None, description="Ошибка обработки записи")
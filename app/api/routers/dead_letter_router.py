@@ -0,0 +1,38 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+
+from app.api.models.dead_letter import DeadLettersOut, ReplayOut
+from app.config import settings
+from app.container import Container
+from app.helpers.redis import RedisRetryQueue
+
+router = APIRouter(prefix="/admin/dead-letters", tags=["admin"])
+
+
+@router.get("")
+async def get_dead_letters(
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+    retry_queue: RedisRetryQueue = Depends(Container.retry_queue),
+) -> DeadLettersOut:
+    """
+    Сообщения очереди модели, не обработанные после всех попыток, от старых к новым
+    """
+    routing_key = settings.AMQP.routing_keys.model_manager_routing_key
+    return DeadLettersOut(
+        total=await retry_queue.dead_letters_count(routing_key),
+        items=await retry_queue.dead_letters(routing_key, offset=offset, limit=limit),
+    )
+
+
+@router.post("/replay")
+async def replay_dead_letters(
+    count: Optional[int] = Query(default=None, ge=1, description="Количество самых старых сообщений, по умолчанию все"),
+    retry_queue: RedisRetryQueue = Depends(Container.retry_queue),
+) -> ReplayOut:
+    """
+    Переотправка сообщений из dead letter list в очередь модели
+    """
+    routing_key = settings.AMQP.routing_keys.model_manager_routing_key
+    return ReplayOut(replayed=await retry_queue.replay(routing_key, count=count))
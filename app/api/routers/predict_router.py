@@ -1,6 +1,14 @@
-from fastapi import APIRouter, Depends
+import asyncio
+import json
+from typing import Any, AsyncIterator, Optional, Union
 
-from app.api.models.predict import PredictIn, PredictOut
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
+
+from app.api.models.predict import PredictBatchItemOut, PredictIn, PredictOut
 from app.container import Container
 from app.workers.model_client import ModelClient
 
@@ -8,5 +16,134 @@ router = APIRouter(tags=["predict"])
 
 
 @router.post("/predict")
-def predict(data: PredictIn, model: ModelClient = Depends(Container.model_client)) -> PredictOut:
-    return model.router_inference(data.model_dump())
+async def predict(data: PredictIn, model: ModelClient = Depends(Container.model_client)) -> PredictOut:
+    prediction = await model.router_inference(data.model_dump())
+    return PredictOut(pred=prediction.pred, model_version=prediction.model_version)
+
+
+@router.post("/predict/batch")
+async def predict_batch(
+    data: Union[list[Any], dict[str, list[Any]]] = Body(
+        description="Массив записей PredictIn или колоночный формат: по массиву значений на каждое поле"
+    ),
+    model: ModelClient = Depends(Container.model_client),
+) -> list[PredictBatchItemOut]:
+    """
+    Скоринг пачки транзакций одним вызовом модели. Ответ в порядке входных записей,
+    ошибки валидации и препроцессинга возвращаются по каждой записи отдельно
+    """
+    records = columns_to_records(data) if isinstance(data, dict) else data
+    return await score_records(records, model)
+
+
+@router.post("/predict/stream", response_class=StreamingResponse)
+async def predict_stream(
+    request: Request,
+    chunk_size: int = Query(default=500, ge=1, le=10000, description="Количество строк в одной пачке скоринга"),
+    model: ModelClient = Depends(Container.model_client),
+):
+    """
+    Потоковый скоринг NDJSON: строки скорятся пачками по chunk_size по мере чтения тела запроса,
+    на каждую непустую входную строку возвращается строка PredictBatchItemOut в том же порядке.
+    Тело читается в отдельной задаче и не ждёт отправки ответа: клиент без дуплекса не читает ответ
+    до конца отправки, и чтение тела не должно останавливаться на заполненном буфере ответа
+    """
+    return DuplexStreamingResponse(stream_predictions(request, model, chunk_size), media_type="application/x-ndjson")
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse, который не слушает receive в ожидании http.disconnect:
+    тело запроса читает сам обработчик параллельно с отправкой ответа, отключение клиента видно по ClientDisconnect
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def score_records(records: list[Any], model: ModelClient) -> list[PredictBatchItemOut]:
+    items = [PredictBatchItemOut() for _ in records]
+    valid_records, valid_indexes = [], []
+    for index, record in enumerate(records):
+        if isinstance(record, Exception):
+            items[index].error = str(record)
+            continue
+        try:
+            valid_records.append(PredictIn.model_validate(record).model_dump())
+        except ValidationError as error:
+            items[index].error = format_validation_error(error)
+        else:
+            valid_indexes.append(index)
+    results = await model.router_batch_inference(valid_records) if valid_records else []
+    for index, result in zip(valid_indexes, results):
+        if isinstance(result, Exception):
+            items[index].error = str(result)
+        else:
+            items[index].pred, items[index].model_version = result
+    return items
+
+
+async def stream_predictions(request: Request, model: ModelClient, chunk_size: int) -> AsyncIterator[bytes]:
+    results: asyncio.Queue[Optional[bytes]] = asyncio.Queue()
+    producer = asyncio.create_task(score_stream(request, model, chunk_size, results))
+    try:
+        while (chunk := await results.get()) is not None:
+            yield chunk
+        await producer
+    finally:
+        producer.cancel()
+
+
+async def score_stream(request: Request, model: ModelClient, chunk_size: int, results: asyncio.Queue) -> None:
+    try:
+        async for records in ndjson_chunks(request.stream(), chunk_size):
+            items = await score_records(records, model)
+            results.put_nowait("".join(f"{item.model_dump_json()}\n" for item in items).encode("utf-8"))
+    except ClientDisconnect:
+        pass
+    finally:
+        results.put_nowait(None)
+
+
+async def ndjson_chunks(stream: AsyncIterator[bytes], chunk_size: int) -> AsyncIterator[list[Any]]:
+    records, buffer = [], bytearray()
+    async for data in stream:
+        buffer += data
+        end = buffer.rfind(b"\n")
+        if end < 0:
+            continue
+        lines = buffer[:end].split(b"\n")
+        del buffer[: end + 1]
+        for line in lines:
+            if line.strip():
+                records.append(parse_ndjson_line(line))
+            if len(records) >= chunk_size:
+                yield records
+                records = []
+    if buffer.strip():
+        records.append(parse_ndjson_line(buffer))
+    if records:
+        yield records
+
+
+def parse_ndjson_line(line: Union[bytes, bytearray]) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return ValueError(f"Некорректная строка NDJSON: {error}")
+
+
+def columns_to_records(columns: dict[str, list[Any]]) -> list[dict[str, Any]]:
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise HTTPException(status_code=422, detail="Массивы колонок должны быть одинаковой длины")
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, detail['loc']))}: {detail['msg']}" if detail["loc"] else detail["msg"]
+        for detail in error.errors()
+    )
@@ -1,8 +1,7 @@
 from functools import partial
 
-from starlette.middleware.base import BaseHTTPMiddleware
-
-from app.amqp.model_consumer import model_on_message
+from app.amqp.model_consumer import model_on_messages
+from app.api.routers.dead_letter_router import router as dead_letter_router
 from app.api.routers.predict_router import router as predict_router
 from app.config import settings
 from app.container import Container
@@ -12,13 +11,22 @@ from app.helpers.api import (
     add_object_not_found_handler,
 )
 from app.helpers.interfaces import AmqpAbc
-from app.helpers.metrics import MetricsMiddleware, add_prometheus_extension
+from app.helpers.metrics import (
+    AsgiMetricsMiddleware,
+    MetricsMiddleware,
+    add_prometheus_extension,
+)
 from app.helpers.optimization import ujson_enable
 
 
 async def start_amqp(amqp_client: AmqpAbc = Container.amqp_client()):
     await amqp_client.init_queue(settings.AMQP.routing_keys.model_manager_routing_key)
-    await amqp_client.init_consumer(settings.AMQP.routing_keys.model_manager_routing_key, model_on_message)
+    await Container.retry_queue().start(settings.AMQP.routing_keys.model_manager_routing_key)
+    await amqp_client.init_batch_consumer(
+        settings.AMQP.routing_keys.model_manager_routing_key,
+        model_on_messages,
+        max_count=settings.AMQP.consumer.batch_size,
+    )
 
 
 ujson_enable()
@@ -28,10 +36,18 @@ app = Server(
     description="Backend service",
     logging_config=settings.LOGGING,
     cors_config=settings.CORS,
-    routers=[predict_router],
-    middlewares=[MetricsMiddleware(BaseHTTPMiddleware)],
-    start_callbacks=[start_amqp],
-    stop_callbacks=[Container.redis().close],
+    # Просмотр и переотправка dead letter без авторизации, включается только явно во внутреннем контуре
+    routers=[predict_router, dead_letter_router] if settings.AMQP.retry.admin_api else [predict_router],
+    middlewares=[MetricsMiddleware(AsgiMetricsMiddleware)],
+    start_callbacks=[Container.model_client().start, start_amqp],
+    stop_callbacks=[
+        Container.amqp_client().close,
+        Container.model_client().close,
+        Container.retry_queue().close,
+        Container.result_publisher().close,
+        Container.redis().close,
+        Container.redis_binary().close,
+    ],
     exception_handlers=[add_object_not_found_handler],
     extensions=[
         partial(
@@ -1,10 +1,39 @@
+from typing import Optional
+
 from redis.asyncio.client import Redis
 
 from app.config import settings
+from app.helpers.codecs import CODECS, create_codec
 from app.helpers.container import providers
 from app.helpers.db import SessionManager
-from app.helpers.redis import RedisQueueAmqp, RedisStreamAmqp
+from app.helpers.interfaces import FileHostingClientAbc
+from app.helpers.redis import (
+    RedisBulkPublisher,
+    RedisQueueAmqp,
+    RedisReliableQueueAmqp,
+    RedisRetryQueue,
+    RedisShardedAmqp,
+    RedisStreamAmqp,
+)
 from app.workers.model_client import ModelClient
+from app.workers.prediction_cache import PredictionCache
+
+AMQP_TRANSPORTS = {
+    "queue": RedisQueueAmqp,
+    "reliable_queue": RedisReliableQueueAmqp,
+    "stream": RedisStreamAmqp,
+}
+
+
+def create_file_hosting_client() -> Optional[FileHostingClientAbc]:
+    """
+    Клиент MinIO для реестра версий модели, создаётся только при наличии секции MINIO в настройках
+    """
+    if not settings.get("MINIO"):
+        return None
+    from app.helpers.minio import MinioClient
+
+    return MinioClient(**settings.MINIO)
 
 
 class Container:
@@ -17,9 +46,60 @@ class Container:
         decode_responses=True,
         db=settings.REDIS.database,
     )
-    amqp_client = providers.Singleton(
-        RedisQueueAmqp,
+    # Бинарным кодекам нужен клиент без decode_responses; кодеки, читающие bytes, тоже работают через него,
+    # чтобы redis-py не декодировал каждое сообщение в str перед разбором
+    redis_binary = providers.Singleton(
+        Redis,
+        host=settings.REDIS.host,
+        port=settings.REDIS.port,
+        username=settings.REDIS.login,
+        password=settings.REDIS.password,
+        decode_responses=False,
+        db=settings.REDIS.database,
+    )
+    codec = providers.Singleton(create_codec, name=settings.AMQP.codec)
+    amqp_transport = providers.Singleton(
+        AMQP_TRANSPORTS[settings.AMQP.consumer.transport],
+        redis=(
+            redis_binary() if CODECS[settings.AMQP.codec].binary or CODECS[settings.AMQP.codec].loads_bytes else redis()
+        ),
+        codec=codec(),
+        concurrency=settings.AMQP.consumer.concurrency,
+        rate_limit=settings.AMQP.consumer.rate_limit,
+        block_timeout=settings.AMQP.consumer.block_timeout,
+        visibility_timeout=settings.AMQP.consumer.visibility_timeout,
+        reap_interval=settings.AMQP.consumer.reap_interval,
+        group_name=settings.AMQP.consumer.group_name,
+        claim_idle_time=settings.AMQP.consumer.claim_idle_time,
+        claim_interval=settings.AMQP.consumer.claim_interval,
+    )
+    # При shards > 1 очередь делится на подочереди по client_id, иначе транспорт используется напрямую
+    amqp_client = (
+        providers.Singleton(
+            RedisShardedAmqp,
+            amqp=amqp_transport(),
+            shards=settings.AMQP.sharding.shards,
+            shard_field=settings.AMQP.sharding.shard_field,
+            rebalance_interval=settings.AMQP.sharding.rebalance_interval,
+        )
+        if settings.AMQP.sharding.shards > 1
+        else amqp_transport
+    )
+    retry_queue = providers.Singleton(
+        RedisRetryQueue,
         redis=redis(),
+        amqp=amqp_client(),
+        max_attempts=settings.AMQP.retry.max_attempts,
+        base_delay=settings.AMQP.retry.base_delay,
+        max_delay=settings.AMQP.retry.max_delay,
+        poll_interval=settings.AMQP.retry.poll_interval,
+        codec=codec(),
+    )
+    result_publisher = providers.Singleton(
+        RedisBulkPublisher,
+        redis=redis(),
+        max_batch_size=settings.AMQP.publisher.max_batch_size,
+        max_wait=settings.AMQP.publisher.max_wait,
     )
     session_manager = providers.Singleton(
         SessionManager,
@@ -35,7 +115,29 @@ class Container:
         max_overflow=settings.POSTGRES.pool_max_size,
         pool_timeout=settings.POSTGRES.pool_timeout,
     )
+    prediction_cache = providers.Singleton(
+        PredictionCache,
+        redis=redis(),
+        ttl=settings.MODEL.prediction_cache.ttl,
+        local_maxsize=settings.MODEL.prediction_cache.local_maxsize,
+    )
     model_client = providers.Singleton(
         ModelClient,
         redis=redis(),
+        publisher=result_publisher(),
+        retry_queue=retry_queue(),
+        codec=codec(),
+        prediction_cache=prediction_cache() if settings.MODEL.prediction_cache.enabled else None,
+        model_path=settings.MODEL.path,
+        models_dir=settings.MODEL.registry.models_dir,
+        file_hosting_client=create_file_hosting_client(),
+        bucket_name=settings.MODEL.registry.bucket_name,
+        poll_interval=settings.MODEL.registry.poll_interval,
+        cache_dir=settings.MODEL.cache_dir,
+        compiled=settings.MODEL.compiled,
+        sample_path=settings.MODEL.sample_path,
+        backend=settings.MODEL.backend.type,
+        workers=settings.MODEL.backend.workers,
+        max_batch_size=settings.MODEL.batcher.max_batch_size,
+        max_wait=settings.MODEL.batcher.max_wait,
     )
@@ -33,6 +33,9 @@ class ProcessStatusOut(StatusOut):
     name: str = Field(description="Имя процесса")
     processes_num_plan: int = Field(description="Количество запланированных процессов")
     processes_num_alive: int = Field(description="Количество живых процессов")
+    processes_num_min: Optional[int] = Field(default=None, description="Минимальное количество процессов")
+    processes_num_max: Optional[int] = Field(default=None, description="Максимальное количество процессов")
+    backlog: Optional[int] = Field(default=None, description="Последний замер размера очереди")
 
 
 def model_annotations_with_parents(model: BaseModel) -> Mapping[str, Any]:
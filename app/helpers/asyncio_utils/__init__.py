@@ -1,4 +1,5 @@
 from app.helpers.asyncio_utils.async_executor import run_in_executor
+from app.helpers.asyncio_utils.rate_limiter import RateLimiter
 from app.helpers.asyncio_utils.run_with_timeout import run_with_timeout
 from app.helpers.asyncio_utils.safe_gather import safe_gather
 from app.helpers.asyncio_utils.scheduled_task import scheduled_task
@@ -8,4 +9,5 @@ __all__ = [
     "run_in_executor",
     "scheduled_task",
     "run_with_timeout",
+    "RateLimiter",
 ]
@@ -0,0 +1,33 @@
+import asyncio
+from time import monotonic
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Ограничение частоты операций по алгоритму token bucket
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        :param rate:        операций в секунду
+        :param burst:       максимальное количество операций подряд без ожидания
+        """
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, count: int = 1) -> None:
+        """
+        Дождаться разрешения на count операций, недостающие токены отрабатываются ожиданием
+        :param count:       количество операций
+        """
+        async with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
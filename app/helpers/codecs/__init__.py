@@ -0,0 +1,35 @@
+from app.helpers.codecs.compressed_codec import CompressedCodec
+from app.helpers.codecs.json_codec import JsonCodec
+from app.helpers.codecs.msgpack_codec import MsgpackCodec
+from app.helpers.codecs.orjson_codec import OrjsonCodec
+from app.helpers.codecs.pickle_codec import PickleCodec
+from app.helpers.interfaces import CodecAbc
+
+CODECS: dict[str, type[CodecAbc]] = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def create_codec(name: str) -> CodecAbc:
+    """
+    Создание кодека по названию из настроек. orjson и msgpack импортируются только при выборе кодека
+    :param name:    json, orjson или msgpack
+    :return:        кодек
+    """
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Неизвестный кодек {name!r}, доступны: {', '.join(CODECS)}") from None
+
+
+__all__ = [
+    "JsonCodec",
+    "OrjsonCodec",
+    "MsgpackCodec",
+    "PickleCodec",
+    "CompressedCodec",
+    "CODECS",
+    "create_codec",
+]
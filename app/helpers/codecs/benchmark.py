@@ -0,0 +1,78 @@
+"""
+Стоимость сериализации сообщения очереди для каждого кодека.
+Запуск: python -m app.helpers.codecs.benchmark [--path config/model_sample.json] [--repeat 20000]
+"""
+
+import argparse
+import json
+from time import perf_counter
+
+from app.helpers.codecs import CODECS
+from app.helpers.optimization import ujson_enable
+
+DEFAULT_MESSAGE = {
+    "record_id": 1,
+    "transaction_id": 1001,
+    "ip": "192.168.0.10",
+    "device_id": 42.0,
+    "device_type": "ATM",
+    "tran_code": 1010,
+    "mcc": 5411,
+    "client_id": 777,
+    "card_type": "DEBIT",
+    "pin_inc_count": 0,
+    "card_status": "active",
+    "datetime": "2024-05-01 12:30:00",
+    "sum": 1500.5,
+    "oper_type": "payment",
+    "expiration_date": "2026-01-01",
+    "balance": 35000.0,
+    "pred": 0.123456789,
+    "model_version": "model@2024-05-01",
+}
+
+
+def benchmark(message: dict, repeat: int) -> list[tuple[str, int, float, float]]:
+    """
+    :param message:     сообщение
+    :param repeat:      количество повторов
+    :return:            (кодек, размер в байтах, мкс на dumps, мкс на loads) для доступных кодеков
+    """
+    results = []
+    for name, codec_class in CODECS.items():
+        try:
+            codec = codec_class()
+        except ImportError:
+            continue
+        data = codec.dumps(message)
+        started = perf_counter()
+        for _ in range(repeat):
+            codec.dumps(message)
+        dumps_time = (perf_counter() - started) / repeat * 1e6
+        started = perf_counter()
+        for _ in range(repeat):
+            codec.loads(data)
+        loads_time = (perf_counter() - started) / repeat * 1e6
+        results.append((name, len(data), dumps_time, loads_time))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", help="json-файл со списком сообщений, берётся первое")
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+    # Как в приложении: json-кодек работает через ujson
+    ujson_enable()
+    message = DEFAULT_MESSAGE
+    if args.path:
+        with open(args.path) as file:
+            message = json.loads(file.read())[0]
+    print(f"{'codec':<10}{'bytes':>8}{'dumps, us':>12}{'loads, us':>12}{'total, us':>12}")  # noqa: T201
+    for name, size, dumps_time, loads_time in benchmark(message, args.repeat):
+        total_time = dumps_time + loads_time
+        print(f"{name:<10}{size:>8}{dumps_time:>12.2f}{loads_time:>12.2f}{total_time:>12.2f}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
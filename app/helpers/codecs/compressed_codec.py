@@ -0,0 +1,72 @@
+from typing import Any, Optional, Union
+
+from app.helpers.interfaces import CodecAbc
+
+# Первый байт данных - способ сжатия, поэтому loads читает и сжатые, и несжатые значения
+RAW = b"\x00"
+ZSTD = b"\x01"
+LZ4 = b"\x02"
+
+
+class CompressedCodec(CodecAbc):
+    """
+    Сжатие результата другого кодека (zstd или lz4), если он длиннее threshold байт
+    """
+
+    name = "compressed"
+    binary = True
+    loads_bytes = True
+
+    def __init__(self, codec: Any, compression: Optional[str] = "zstd", threshold: int = 1024, level: int = 3):
+        """
+        :param codec:           кодек значений, подойдёт любой объект с dumps и loads
+        :param compression:     zstd, lz4 или None - без сжатия. Библиотека импортируется только при выборе
+        :param threshold:       минимальный размер сжимаемых данных в байтах
+        :param level:           уровень сжатия zstd
+        """
+        self.codec = codec
+        self.compression = compression
+        self.threshold = threshold
+        self._compress = None
+        self._decompressors = {}
+        if compression == "zstd":
+            import zstandard
+
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+            self._marker = ZSTD
+        elif compression == "lz4":
+            import lz4.frame
+
+            self._compress = lz4.frame.compress
+            self._marker = LZ4
+        elif compression is not None:
+            raise ValueError(f"Неизвестный способ сжатия {compression!r}, доступны: zstd, lz4")
+
+    def dumps(self, message: Any) -> bytes:
+        data = self.codec.dumps(message)
+        if self._compress and len(data) >= self.threshold:
+            return self._marker + self._compress(data)
+        return RAW + data
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        marker, data = data[:1], data[1:]
+        if marker == ZSTD:
+            data = self._decompressor(ZSTD)(data)
+        elif marker == LZ4:
+            data = self._decompressor(LZ4)(data)
+        return self.codec.loads(data)
+
+    def _decompressor(self, marker: bytes) -> callable:
+        # Значение могло быть сжато другим способом, если настройку меняли
+        if marker not in self._decompressors:
+            if marker == ZSTD:
+                import zstandard
+
+                self._decompressors[marker] = zstandard.ZstdDecompressor().decompress
+            else:
+                import lz4.frame
+
+                self._decompressors[marker] = lz4.frame.decompress
+        return self._decompressors[marker]
@@ -0,0 +1,20 @@
+import json
+from typing import Any, Union
+
+from app.helpers.interfaces import CodecAbc
+
+
+class JsonCodec(CodecAbc):
+    """
+    JSON через модуль json (после ujson_enable - через ujson)
+    """
+
+    name = "json"
+    binary = False
+    loads_bytes = True
+
+    def dumps(self, message: Any) -> bytes:
+        return json.dumps(message).encode("utf-8")
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
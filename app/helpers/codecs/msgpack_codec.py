@@ -0,0 +1,25 @@
+from typing import Any, Union
+
+from app.helpers.interfaces import CodecAbc
+
+
+class MsgpackCodec(CodecAbc):
+    """
+    Бинарная сериализация msgpack, требует клиент redis с decode_responses=False
+    """
+
+    name = "msgpack"
+    binary = True
+    loads_bytes = True
+
+    def __init__(self):
+        import msgpack
+
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def dumps(self, message: Any) -> bytes:
+        return self._packb(message, use_bin_type=True)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return self._unpackb(data, raw=False)
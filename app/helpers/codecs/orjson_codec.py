@@ -0,0 +1,24 @@
+from typing import Any, Union
+
+from app.helpers.interfaces import CodecAbc
+
+
+class OrjsonCodec(CodecAbc):
+    """
+    JSON через orjson: сериализует сразу в bytes, без промежуточной строки
+    """
+
+    name = "orjson"
+    binary = False
+    loads_bytes = True
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, message: Any) -> bytes:
+        return self._orjson.dumps(message, option=self._orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return self._orjson.loads(data)
@@ -0,0 +1,26 @@
+import pickle
+from typing import Any, Union
+
+from app.helpers.interfaces import CodecAbc
+
+
+class PickleCodec(CodecAbc):
+    """
+    Сериализация pickle, по умолчанию протоколом 5: любые python-объекты, только для доверенных данных
+    """
+
+    name = "pickle"
+    binary = True
+    loads_bytes = True
+
+    def __init__(self, protocol: int = 5):
+        """
+        :param protocol:    протокол pickle
+        """
+        self.protocol = protocol
+
+    def dumps(self, message: Any) -> bytes:
+        return pickle.dumps(message, protocol=self.protocol)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return pickle.loads(data)
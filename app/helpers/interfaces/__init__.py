@@ -1,5 +1,6 @@
 from app.helpers.interfaces.amqp_abc import AmqpAbc
 from app.helpers.interfaces.client_http_abc import ClientHttpAbc
+from app.helpers.interfaces.codec_abc import CodecAbc
 from app.helpers.interfaces.file_hosting_abc import (
     FileHostingClientAbc,
     FileReaderProtocol,
@@ -14,4 +15,5 @@ __all__ = [
     "FileReaderProtocol",
     "WebsocketManagerAbc",
     "ClientHttpAbc",
+    "CodecAbc",
 ]
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from json import dumps
-from typing import Any, Union
+from typing import Any, Optional, Union
+
+from app.helpers.interfaces.codec_abc import CodecAbc
 
 
 class AmqpAbc(ABC):
@@ -9,16 +11,17 @@ class AmqpAbc(ABC):
     """
 
     @staticmethod
-    def convert_message(message: Union[str, bytes, list, dict]) -> bytes:
+    def convert_message(message: Union[str, bytes, list, dict], codec: Optional[CodecAbc] = None) -> bytes:
         """
         Конвертация сообщения в bytes
         :param message:     сообщение
+        :param codec:       кодек для list и dict, по умолчанию json
         :return:            сообщение в bytes
         """
         if isinstance(message, str):
             return message.encode("utf-8")
         if isinstance(message, (list, dict)):
-            return dumps(message).encode("utf-8")
+            return codec.dumps(message) if codec else dumps(message).encode("utf-8")
         return message
 
     @abstractmethod
@@ -59,11 +62,25 @@ class AmqpAbc(ABC):
         :return:                        Any
         """
 
-    # TODO: разработать для всех клиентов метод получения пачки сообщений
-    # @abstractmethod
-    # async def get_messages(self, routing_key: str) -> Any:
-    #     """
-    #     Получить сообщение из очереди
-    #     :param routing_key:             название очереди
-    #     :return:                        Any
-    #     """
+    @abstractmethod
+    async def get_messages(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> list:
+        """
+        Получить пачку сообщений из очереди: ждёт первое сообщение и забирает уже доступные, не больше max_count
+        :param routing_key:             название очереди
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений на стороне брокера в секундах
+        :return:                        список сообщений
+        """
+
+    @abstractmethod
+    async def init_batch_consumer(
+        self, routing_key: str, on_messages: callable, max_count: int = 100, max_wait: Optional[float] = None, **kwargs
+    ) -> None:
+        """
+        Инициализация слушателя очереди, передающего в callback пачки сообщений
+        :param routing_key:             название очереди
+        :param on_messages:             callback получения списка сообщений
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений в секундах
+        :return:                        None
+        """
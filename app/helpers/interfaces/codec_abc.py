@@ -0,0 +1,33 @@
+from abc import ABC, abstractmethod
+from typing import Any, Union
+
+
+class CodecAbc(ABC):
+    """
+    Сериализация сообщений очередей
+    :attr name:         название кодека в настройках
+    :attr binary:       результат dumps не является текстом utf-8, клиент redis должен работать с bytes
+    :attr loads_bytes:  loads принимает bytes, сообщения можно читать клиентом redis без decode_responses
+    """
+
+    name: str
+    binary: bool = False
+    loads_bytes: bool = False
+
+    @abstractmethod
+    def dumps(self, message: Any) -> bytes:
+        """
+        Сериализация сообщения
+        :param message:     сообщение
+        :return:            байты
+        """
+        pass
+
+    @abstractmethod
+    def loads(self, data: Union[str, bytes]) -> Any:
+        """
+        Десериализация сообщения
+        :param data:        байты или строка
+        :return:            сообщение
+        """
+        pass
@@ -1,7 +1,11 @@
 from app.helpers.metrics.prometheus_extension import add_prometheus_extension
-from app.helpers.metrics.prometheus_middleware import MetricsMiddleware
+from app.helpers.metrics.prometheus_middleware import (
+    AsgiMetricsMiddleware,
+    MetricsMiddleware,
+)
 
 __all__ = [
     "add_prometheus_extension",
+    "AsgiMetricsMiddleware",
     "MetricsMiddleware",
 ]
@@ -5,17 +5,52 @@ from traceback import format_exc
 from fastapi import Request
 from fastapi.responses import PlainTextResponse
 from prometheus_client import Counter, Histogram
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.helpers.interfaces.middleware import MiddlewareAbc
 
 
+class AsgiMetricsMiddleware:
+    """
+    ASGI-middleware для MetricsMiddleware. В отличие от BaseHTTPMiddleware не оборачивает receive и send,
+    поэтому обработчик может читать тело запроса, пока уже отправляет ответ
+    """
+
+    def __init__(self, app: ASGIApp, dispatch: "MetricsMiddleware"):
+        self.app = app
+        self.dispatch = dispatch
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time()
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                # Как и call_next, считаем запрос выполненным в момент начала ответа
+                response_started = True
+                self.dispatch.observe(scope, start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:  # noqa
+            self.dispatch.observe_exception(scope)
+            if response_started:
+                raise
+            await PlainTextResponse(status_code=500, content="Internal Server Error")(scope, receive, send)
+
+
 class MetricsMiddleware(MiddlewareAbc):
     """
     Класс сбора метрик для prometheus
     """
 
-    def __init__(self, middleware_class: type[BaseHTTPMiddleware], logger: logging.Logger = None):
+    def __init__(self, middleware_class: type[AsgiMetricsMiddleware], logger: logging.Logger = None):
         self.request_latency_seconds = Histogram(
             name="request_latency_seconds",
             documentation="Гистограмма времени выполнения запросов",
@@ -37,16 +72,22 @@ class MetricsMiddleware(MiddlewareAbc):
         start = time()
         try:
             response = await call_next(request)
-        except Exception as error:  # noqa
-            path = self.delete_path_params(request.scope["path"], request.path_params)
-            self.logger.error(format_exc(chain=False))
-            self.request_exceptions_total.labels(path=path, method=request.method).inc()
+        except Exception:  # noqa
+            self.observe_exception(request.scope)
             return PlainTextResponse(status_code=500, content="Internal Server Error")
-        path = self.delete_path_params(request.scope["path"], request.path_params)
-        self.request_latency_seconds.labels(path=path, method=request.method).observe(time() - start)
-        self.request_completed_total.labels(path=path, method=request.method).inc()
+        self.observe(request.scope, start)
         return response
 
+    def observe(self, scope: Scope, start: float) -> None:
+        path = self.delete_path_params(scope["path"], scope.get("path_params", {}))
+        self.request_latency_seconds.labels(path=path, method=scope["method"]).observe(time() - start)
+        self.request_completed_total.labels(path=path, method=scope["method"]).inc()
+
+    def observe_exception(self, scope: Scope) -> None:
+        path = self.delete_path_params(scope["path"], scope.get("path_params", {}))
+        self.logger.error(format_exc(chain=False))
+        self.request_exceptions_total.labels(path=path, method=scope["method"]).inc()
+
     @classmethod
     def delete_path_params(cls, path: str, path_params: dict) -> str:
         for path_param in path_params.values():
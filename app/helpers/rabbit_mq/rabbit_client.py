@@ -1,12 +1,12 @@
 import asyncio
-import json
 import logging
-from typing import Any, Union
+import traceback
+from typing import Any, Optional, Union
 
-from aio_pika import Message, connect_robust
+from aio_pika import IncomingMessage, Message, connect_robust
 from yarl import URL
 
-from app.helpers.interfaces import AmqpAbc
+from app.helpers.interfaces import AmqpAbc, CodecAbc
 
 
 class RabbitClient(AmqpAbc):
@@ -19,19 +19,41 @@ class RabbitClient(AmqpAbc):
         protocol: str = "amqp",
         timeout: int = 10,
         logger: logging.Logger = None,
+        prefetch_count: int = 100,
+        concurrency: int = 1,
+        publisher_confirms: bool = True,
+        publish_batch_size: int = 100,
+        max_pending_publishes: int = 10000,
+        codec: Optional[CodecAbc] = None,
     ):
         """
-        :param protocol:            протокол
-        :param host:                хост
-        :param port:                порт
-        :param login:               логин
-        :param password:            пароль
-        :param logger:              логгер
-        :param loop:                AbstractEventLoop
+        :param protocol:                протокол
+        :param host:                    хост
+        :param port:                    порт
+        :param login:                   логин
+        :param password:                пароль
+        :param logger:                  логгер
+        :param prefetch_count:          максимальное количество неподтверждённых сообщений у слушателей канала
+        :param concurrency:             количество одновременно обрабатываемых сообщений (пачек) слушателем
+        :param publisher_confirms:      ожидание подтверждения публикации от брокера
+        :param publish_batch_size:      количество публикаций, подтверждения которых ожидаются одной группой
+        :param max_pending_publishes:   размер буфера send, при заполнении send ждёт освобождения места
+        :param codec:                   кодек сообщений: send сериализует list и dict, пакетный слушатель
+                                        получает десериализованные сообщения. None - json и тела как есть
         """
         self.connection = None
         self.queues = {}
         self.channel = None
+        self.prefetch_count = prefetch_count
+        self.concurrency = concurrency
+        self.publisher_confirms = publisher_confirms
+        self.publish_batch_size = publish_batch_size
+        self.max_pending_publishes = max_pending_publishes
+        self.codec = codec
+        self._publish_queue: Optional[asyncio.Queue] = None
+        self._publisher: Optional[asyncio.Task] = None
+        self._handlers: set[asyncio.Task] = set()
+        self._buffers: dict[str, asyncio.Queue] = {}
 
         self.logger = logger or logging
         self.protocol = protocol
@@ -51,8 +73,9 @@ class RabbitClient(AmqpAbc):
         :param kwargs:      дополнительные параметры подключения
         :return:
         """
-        self.connection = await connect_robust(url=self.url, loop=self.loop, **kwargs)
-        self.channel = await self.connection.channel()
+        self.connection = await connect_robust(url=self.url, **kwargs)
+        self.channel = await self.connection.channel(publisher_confirms=self.publisher_confirms)
+        await self.channel.set_qos(prefetch_count=self.prefetch_count)
         self.logger.info("Подключение к rabbitmq %s прошло успешно", self.url.with_password("******"))
 
     async def init_queue(self, routing_key: str, **kwargs) -> None:
@@ -70,50 +93,199 @@ class RabbitClient(AmqpAbc):
 
     async def close(self) -> None:
         """
-        Закрытие подключения
+        Закрытие подключения, перед ним дожидается публикации сообщений из буфера send
         :return:
         """
+        await self.flush()
+        if self._publisher:
+            self._publisher.cancel()
         if not self.connection.is_closed:
             await self.connection.close()
         self.logger.info("Закрытие подключения к rabbitmq %s прошло успешно", self.url.with_password("******"))
 
     async def init_consumer(self, routing_key: str, on_message: callable, **kwargs) -> None:
         """
-        Инициализация слушателя
+        Инициализация слушателя, не больше concurrency сообщений обрабатываются одновременно,
+        остальные доставленные (не больше prefetch_count) ждут свободного обработчика
         :param routing_key:     название очереди
         :param on_message:      каллбек для слушателя
         :param kwargs:          дополнительные параметры
         :return:
         """
-        await self.queues[routing_key].consume(callback=on_message, **kwargs)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded_on_message(message: IncomingMessage) -> None:
+            async with semaphore:
+                await on_message(message)
+
+        await self.queues[routing_key].consume(callback=bounded_on_message, **kwargs)
+
+    async def init_batch_consumer(
+        self, routing_key: str, on_messages: callable, max_count: int = 100, max_wait: Optional[float] = None, **kwargs
+    ) -> None:
+        """
+        Инициализация слушателя, передающего в callback пачки тел сообщений.
+        Доставленные брокером сообщения копятся в буфере, пачка - всё, что накопилось к моменту её сбора,
+        но не больше max_count. Одновременно обрабатывается не больше concurrency пачек, для полных пачек
+        prefetch_count должен быть не меньше max_count * concurrency.
+        Пачка подтверждается после успешной обработки, при ошибке возвращается в очередь
+        :param routing_key:     название очереди
+        :param on_messages:     каллбек получения списка тел сообщений
+        :param max_count:       максимальный размер пачки
+        :param max_wait:        время досбора пачки после первого сообщения в секундах, None - не ждать
+        :return:
+        """
+        if self.prefetch_count and self.prefetch_count < max_count * self.concurrency:
+            self.logger.warning(
+                "prefetch_count=%s меньше max_count * concurrency=%s, пачки будут неполными",
+                self.prefetch_count,
+                max_count * self.concurrency,
+            )
+        buffer = await self._delivery_buffer(routing_key)
+        asyncio.create_task(self._batch_consumer_callback(routing_key, buffer, on_messages, max_count, max_wait))
+        self.logger.info("Инициализация пакетного слушателя очереди %s прошла успешно", routing_key)
 
     async def send(self, message: Union[str, bytes, dict, list], routing_key: str, **kwargs) -> None:
         """
-        Отправка сообщения
+        Отправка сообщения через буфер публикации: сообщения публикуются группами по publish_batch_size,
+        подтверждения группы ожидаются одновременно. При заполненном буфере ждёт освобождения места
         :param message:         сообщение
         :param routing_key:     название очереди
         :param kwargs:          дополнительные параметры
         :return:
         """
-        if isinstance(message, str):
-            message = message.encode("utf-8")
-        elif isinstance(message, (dict, list)):
-            message = json.dumps(message).encode("utf-8")
-        elif isinstance(message, bytes):
-            message = message
-        else:
+        aio_pika_message = self._make_message(message, **kwargs)
+        if self._publisher is None or self._publisher.done():
+            self._publish_queue = asyncio.Queue(maxsize=self.max_pending_publishes)
+            self._publisher = asyncio.create_task(self._publish_loop())
+        await self._publish_queue.put((aio_pika_message, routing_key))
+
+    async def send_many(self, messages: list, routing_key: str, **kwargs) -> None:
+        """
+        Отправка пачки сообщений с ожиданием подтверждений всей пачки
+        :param messages:        сообщения
+        :param routing_key:     название очереди
+        :param kwargs:          дополнительные параметры
+        :return:
+        """
+        for start in range(0, len(messages), self.publish_batch_size):
+            await asyncio.gather(
+                *(
+                    self.channel.default_exchange.publish(self._make_message(message, **kwargs), routing_key)
+                    for message in messages[start : start + self.publish_batch_size]
+                )
+            )
+        self.logger.info("Отправка %s сообщений в очередь %s прошла успешно", len(messages), routing_key)
+
+    async def flush(self) -> None:
+        """
+        Дождаться публикации всех сообщений из буфера send
+        """
+        if self._publisher and not self._publisher.done():
+            await self._publish_queue.join()
+
+    def _make_message(self, message: Union[str, bytes, dict, list], **kwargs) -> Message:
+        if not isinstance(message, (str, bytes, dict, list)):
             raise TypeError(f"Не поддерживаемы тип сообщения {type(message)}")
+        message = self.convert_message(message, self.codec)
 
-        aio_pika_message = Message(
-            body=message, headers=kwargs.get("headers", {}), delivery_mode=kwargs.get("delivery_mode")
-        )
-        asyncio.create_task(self.channel.default_exchange.publish(aio_pika_message, routing_key=routing_key))
-        self.logger.info("Отправка сообщения в очередь %s прошло успешно", routing_key)
+        return Message(body=message, headers=kwargs.get("headers", {}), delivery_mode=kwargs.get("delivery_mode"))
 
-    async def get_message(self, routing_key: str) -> Any:
+    async def _publish_loop(self) -> None:
+        while True:
+            batch = [await self._publish_queue.get()]
+            while len(batch) < self.publish_batch_size and not self._publish_queue.empty():
+                batch.append(self._publish_queue.get_nowait())
+            results = await asyncio.gather(
+                *(self.channel.default_exchange.publish(message, routing_key) for message, routing_key in batch),
+                return_exceptions=True,
+            )
+            for (_message, routing_key), result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    self.logger.error("Ошибка отправки сообщения в очередь %s: %r", routing_key, result)
+                self._publish_queue.task_done()
+            self.logger.debug("Отправка %s сообщений прошла успешно", len(batch))
+
+    async def _batch_consumer_callback(
+        self,
+        routing_key: str,
+        buffer: asyncio.Queue,
+        on_messages: callable,
+        max_count: int,
+        max_wait: Optional[float],
+    ) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
         while True:
-            message = await self.queues[routing_key].get(timeout=self.timeout, fail=False)
-            if message:
-                await message.ack()
-                return message
-            await asyncio.sleep(0.01)
+            await semaphore.acquire()
+            messages = await self._collect(buffer, max_count, max_wait)
+            task = asyncio.create_task(self._handle_messages(routing_key, on_messages, messages))
+            self._handlers.add(task)
+            task.add_done_callback(self._handlers.discard)
+            task.add_done_callback(lambda _task: semaphore.release())
+
+    async def _handle_messages(self, routing_key: str, on_messages: callable, messages: list[IncomingMessage]):
+        try:
+            bodies = [self._decode(message.body) for message in messages]
+            if asyncio.iscoroutinefunction(on_messages):
+                await on_messages(bodies)
+            else:
+                await asyncio.to_thread(on_messages, bodies)
+        except:  # noqa
+            self.logger.error("Ошибка при обработки сообщений из очереди %s", routing_key)
+            self.logger.error(traceback.format_exc())
+            for message in messages:
+                await message.nack(requeue=True)
+            return
+        for message in messages:
+            await message.ack()
+
+    def _decode(self, body: bytes) -> Any:
+        if not self.codec:
+            return body
+        try:
+            return self.codec.loads(body)
+        except Exception:  # noqa
+            self.logger.warning("Сообщение не разобрано кодеком %s: %r", self.codec.name, body)
+            return body
+
+    async def get_message(self, routing_key: str) -> Any:
+        message = await (await self._delivery_buffer(routing_key)).get()
+        await message.ack()
+        return message
+
+    async def get_messages(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> list:
+        """
+        Получить пачку сообщений: ждёт первое сообщение и забирает уже доставленные брокером, не больше max_count
+        :param routing_key:     название очереди
+        :param max_count:       максимальный размер пачки
+        :param max_wait:        время досбора пачки после первого сообщения в секундах, None - не ждать
+        :return:                список сообщений
+        """
+        messages = await self._collect(await self._delivery_buffer(routing_key), max_count, max_wait)
+        for message in messages:
+            await message.ack()
+        return messages
+
+    async def _delivery_buffer(self, routing_key: str) -> asyncio.Queue:
+        # Сообщения доставляются подпиской с prefetch_count вместо опроса basic.get
+        if routing_key not in self._buffers:
+            self._buffers[routing_key] = asyncio.Queue()
+            await self.queues[routing_key].consume(callback=self._buffers[routing_key].put)
+        return self._buffers[routing_key]
+
+    @staticmethod
+    async def _collect(buffer: asyncio.Queue, max_count: int, max_wait: Optional[float]) -> list[IncomingMessage]:
+        messages = [await buffer.get()]
+        deadline = asyncio.get_running_loop().time() + (max_wait or 0)
+        while len(messages) < max_count:
+            if not buffer.empty():
+                messages.append(buffer.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                messages.append(await asyncio.wait_for(buffer.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return messages
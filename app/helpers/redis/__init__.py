@@ -1,5 +1,19 @@
+from app.helpers.redis.local_cache import LocalCache
+from app.helpers.redis.redis_bulk_publisher import RedisBulkPublisher
 from app.helpers.redis.redis_cache import RedisCache
 from app.helpers.redis.redis_queue_amqp import RedisQueueAmqp
+from app.helpers.redis.redis_reliable_queue_amqp import RedisReliableQueueAmqp
+from app.helpers.redis.redis_retry_queue import RedisRetryQueue
+from app.helpers.redis.redis_sharded_amqp import RedisShardedAmqp
 from app.helpers.redis.redis_stream_amqp import RedisStreamAmqp
 
-__all__ = ["RedisStreamAmqp", "RedisQueueAmqp", "RedisCache"]
+__all__ = [
+    "RedisStreamAmqp",
+    "RedisQueueAmqp",
+    "RedisCache",
+    "LocalCache",
+    "RedisBulkPublisher",
+    "RedisReliableQueueAmqp",
+    "RedisRetryQueue",
+    "RedisShardedAmqp",
+]
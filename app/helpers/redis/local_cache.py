@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    LRU-кеш в памяти процесса с ограничением по количеству записей и временем жизни каждой записи
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize:     максимальное количество записей, при переполнении вытесняется давно не читанная
+        :param ttl:         максимальное время жизни записи в секундах, None - только ttl при записи
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        :param key:         ключ
+        :param default:     значение при отсутствии или истечении записи
+        """
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        :param key:         ключ
+        :param value:       значение
+        :param ttl:         время жизни записи в секундах, не больше ttl кеша
+        """
+        ttl = min(ttl, self.ttl) if ttl is not None and self.ttl is not None else ttl or self.ttl
+        if not ttl or ttl <= 0:
+            return
+        self._data[key] = (monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
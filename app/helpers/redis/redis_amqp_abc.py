@@ -2,46 +2,200 @@ import asyncio
 import logging
 import traceback
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Coroutine, Optional
 
 from redis.asyncio import Redis
+from tenacity import retry, wait_random
 
-from app.helpers.interfaces import AmqpAbc
+from app.helpers.asyncio_utils import RateLimiter
+from app.helpers.interfaces import AmqpAbc, CodecAbc
 
 
 class RedisAmqpAbc(AmqpAbc, ABC):
+    """
+    :attr redelivers:   сообщения, прочитанные, но не подтверждённые (в том числе при отмене чтения),
+                        возвращаются в очередь самим транспортом
+    """
+
+    redelivers: bool = False
+
     def __init__(
         self,
         redis: Redis,
         logger: logging.Logger = None,
         listening_periodicity: float = 0.01,
         timeout: int = 10,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
+        codec: Optional[CodecAbc] = None,
         **kwargs,
     ):
+        """
+        :param redis:                   клиент redis
+        :param logger:                  логгер
+        :param listening_periodicity:   пауза между опросами пустой очереди в секундах
+        :param timeout:                 таймаут операций redis в секундах
+        :param concurrency:             количество одновременно обрабатываемых сообщений
+        :param rate_limit:              ограничение получаемых сообщений в секунду, None - без ограничения
+        :param codec:                   кодек сообщений: send сериализует list и dict, слушатели получают
+                                        десериализованные сообщения. None - сообщения передаются как есть
+        """
         self.redis: Redis = redis
         self.logger = logger or logging
         self.timeout = timeout
         self.listening_periodicity = listening_periodicity
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.codec = codec
         self.queues_extra = {}
+        self._consumers: set[asyncio.Task] = set()
+        self._handlers: set[asyncio.Task] = set()
+
+    async def init_batch_consumer(
+        self, routing_key: str, on_messages: callable, max_count: int = 100, max_wait: Optional[float] = None, **kwargs
+    ) -> None:
+        """
+        Инициализация слушателя очереди, передающего в callback пачки сообщений
+        :param routing_key:             название очереди
+        :param on_messages:             callback получения списка сообщений
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений в секундах, по умолчанию block_timeout
+        """
+        self.run_consumer(
+            retry(wait=wait_random(min=1, max=10))(self.batch_consumer_callback)(
+                routing_key, on_messages, max_count, max_wait
+            )
+        )
+        self.logger.info("Инициализация пакетного слушателя очереди %s прошла успешно", routing_key)
+
+    async def receive(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> tuple:
+        """
+        Получить пачку сообщений для слушателя вместе с квитанцией, по которой они подтверждаются через ack
+        после успешной обработки. По умолчанию сообщения подтверждены уже при получении
+        :param routing_key:             название очереди
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений в секундах
+        :return:                        (список сообщений, квитанция)
+        """
+        messages = await self.get_messages(routing_key, max_count=max_count, max_wait=max_wait)
+        return self.decode_messages(messages), None
+
+    def decode_messages(self, messages: list) -> list:
+        """
+        Десериализация сообщений кодеком клиента. Сообщение, которое не удалось разобрать, передаётся как есть,
+        чтобы ошибка одного сообщения не останавливала слушателя
+        :param messages:                сообщения из очереди
+        :return:                        сообщения
+        """
+        if not self.codec:
+            return messages
+        decoded = []
+        for message in messages:
+            try:
+                decoded.append(self.codec.loads(message))
+            except Exception:  # noqa
+                self.logger.warning("Сообщение не разобрано кодеком %s: %r", self.codec.name, message)
+                decoded.append(message)
+        return decoded
+
+    async def ack(self, routing_key: str, receipt: Any) -> None:
+        """
+        Подтвердить обработку сообщений
+        :param routing_key:             название очереди
+        :param receipt:                 квитанция из receive
+        """
+        return
+
+    async def close(self) -> None:
+        """
+        Остановка слушателей: чтение новых сообщений прекращается, начатая обработка дожидается завершения.
+        Пачка, чтение которой прервано, теряется, если транспорт не возвращает сообщения сам (redelivers)
+        """
+        consumers = list(self._consumers)
+        for task in consumers:
+            task.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        await asyncio.gather(*list(self._handlers), return_exceptions=True)
+
+    def run_consumer(self, coro: Coroutine) -> asyncio.Task:
+        """
+        Запуск цикла слушателя, цикл останавливается в close
+        :param coro:                    корутина цикла слушателя
+        """
+        task = asyncio.create_task(coro)
+        self._consumers.add(task)
+        task.add_done_callback(self._consumers.discard)
+        return task
+
+    def _run_handler(self, coro: Coroutine, semaphore: asyncio.Semaphore) -> None:
+        task = asyncio.create_task(coro)
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+        task.add_done_callback(lambda _task: semaphore.release())
 
     async def consumer_callback(self, routing_key: str, on_message: callable):
         """
-        Слушатель сообщений из очереди
+        Слушатель сообщений из очереди: сообщения обрабатываются параллельно, не больше concurrency одновременно
         :param routing_key:             название очереди
         :param on_message:              callback получения сообщения
         """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            await semaphore.acquire()
+            try:
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire()
+                [message], receipt = await self.receive(routing_key, max_count=1)
+            except BaseException:
+                semaphore.release()
+                raise
+            self._run_handler(self.handle_message(routing_key, on_message, message, receipt), semaphore)
+
+    async def batch_consumer_callback(
+        self, routing_key: str, on_messages: callable, max_count: int = 100, max_wait: Optional[float] = None
+    ):
+        """
+        Слушатель пачек сообщений из очереди: не больше concurrency пачек обрабатываются одновременно
+        :param routing_key:             название очереди
+        :param on_messages:             callback получения списка сообщений
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений в секундах
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
         while True:
-            message = await self.get_message(routing_key)
-            self.logger.debug("Обработка сообщения из очереди %s...", routing_key)
+            await semaphore.acquire()
             try:
-                if asyncio.iscoroutinefunction(on_message):
-                    await on_message(message)
-                else:
-                    await asyncio.to_thread(on_message, message)
-                self.logger.debug("Обработка сообщения из очереди %s прошла успешно", routing_key)
-            except:  # noqa
-                self.logger.error("Ошибка при обработки сообщения из очереди %s", routing_key)
-                self.logger.error(traceback.format_exc())
+                messages, receipt = await self.receive(routing_key, max_count=max_count, max_wait=max_wait)
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire(len(messages))
+            except BaseException:
+                semaphore.release()
+                raise
+            self._run_handler(self.handle_message(routing_key, on_messages, messages, receipt), semaphore)
+
+    async def handle_message(self, routing_key: str, on_message: callable, message: Any, receipt: Any = None) -> bool:
+        """
+        Обработка сообщения (или пачки сообщений) из очереди, при успехе сообщения подтверждаются по квитанции
+        :param routing_key:             название очереди
+        :param on_message:              callback получения сообщения
+        :param message:                 сообщение или список сообщений
+        :param receipt:                 квитанция из receive
+        :return:                        успешность обработки
+        """
+        self.logger.debug("Обработка сообщения из очереди %s...", routing_key)
+        try:
+            if asyncio.iscoroutinefunction(on_message):
+                await on_message(message)
+            else:
+                await asyncio.to_thread(on_message, message)
+            self.logger.debug("Обработка сообщения из очереди %s прошла успешно", routing_key)
+        except:  # noqa
+            self.logger.error("Ошибка при обработки сообщения из очереди %s", routing_key)
+            self.logger.error(traceback.format_exc())
+            return False
+        if receipt is not None:
+            await self.ack(routing_key, receipt)
+        return True
 
 
 class MessageRedisAbc(ABC):
@@ -53,14 +207,20 @@ class MessageRedisAbc(ABC):
         noack: bool,
         rollback_on_error: bool,
         logger: logging.Logger,
+        retry_queue: Any = None,
         **kwargs,
     ):
+        """
+        :param retry_queue:     RedisRetryQueue, через которую откатываются сообщения с ошибкой обработки,
+                                None - сообщение возвращается в конец исходной очереди
+        """
         self.redis = redis
         self.routing_key = routing_key
         self.body = body
         self.noack = noack
         self.rollback_on_error = rollback_on_error
         self.logger = logger
+        self.retry_queue = retry_queue
 
     async def __aenter__(self):
         if not self.noack:
@@ -71,7 +231,7 @@ class MessageRedisAbc(ABC):
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if exc_type:
             if self.rollback_on_error:
-                await self.rollback()
+                await self.rollback(exc_val)
 
     @abstractmethod
     async def delete(self):
@@ -82,5 +242,5 @@ class MessageRedisAbc(ABC):
         pass
 
     @abstractmethod
-    async def rollback(self):
+    async def rollback(self, error: Optional[BaseException] = None):
         pass
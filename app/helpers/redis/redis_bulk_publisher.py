@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Optional
+
+from prometheus_client import Histogram
+from redis.asyncio import Redis
+
+REDIS_BULK_PUBLISHER_FLUSH_SIZE = Histogram(
+    name="redis_bulk_publisher_flush_size",
+    documentation="Гистограмма количества сообщений, отправленных в redis за один запрос",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+
+class RedisBulkPublisher:
+    """
+    Буферизованная отправка сообщений в очереди redis (list).
+    Сообщения копятся в памяти и уходят одним многозначным RPUSH на очередь в общем pipeline,
+    когда в буфере набралось max_batch_size сообщений или с первого сообщения прошло max_wait секунд.
+    publish возвращает future сброса, в который попало сообщение. При ошибке отправки сообщения
+    не возвращаются в буфер, ошибка уходит в future, и повторную отправку делает вызывающий код:
+    повтор и в буфере, и у вызывающего дублировал бы сообщения.
+    Буфер обязательно сбрасывается в close, его нужно вызывать при остановке сервиса
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        max_batch_size: int = 500,
+        max_wait: float = 0.05,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param redis:               клиент redis
+        :param max_batch_size:      количество сообщений в буфере, при котором он сбрасывается сразу
+        :param max_wait:            максимальное время нахождения сообщения в буфере в секундах
+        :param logger:              логгер
+        """
+        self.redis = redis
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.logger = logger or logging
+        self._buffer: dict[str, list] = {}
+        self._size = 0
+        self._sent: Optional[asyncio.Future] = None
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def publish(self, routing_key: str, message) -> asyncio.Future:
+        """
+        Поставить сообщение в буфер отправки
+        :param routing_key:     название очереди
+        :param message:         сериализованное сообщение
+        :return:                future, которое завершается после отправки сообщения в redis или с ошибкой отправки
+        """
+        if self._sent is None:
+            self._sent = asyncio.get_running_loop().create_future()
+            # Ошибка уже залогирована в flush, ждать future не обязательно
+            self._sent.add_done_callback(lambda future: future.cancelled() or future.exception())
+        sent = self._sent
+        self._buffer.setdefault(routing_key, []).append(message)
+        self._size += 1
+        if self._size >= self.max_batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+        return sent
+
+    async def flush(self) -> None:
+        """
+        Отправить все накопленные сообщения. Ошибка отправки не пробрасывается, а передаётся в future сообщений
+        """
+        async with self._lock:
+            if not self._size:
+                return
+            buffer, size, sent = self._buffer, self._size, self._sent
+            self._buffer, self._size, self._sent = {}, 0, None
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for routing_key, messages in buffer.items():
+                        pipe.rpush(routing_key, *messages)
+                    await pipe.execute()
+                sent.set_result(None)
+            except Exception as error:
+                self.logger.exception("Ошибка отправки %s сообщений в redis", size)
+                sent.set_exception(error)
+                return
+            finally:
+                if not sent.done():
+                    # Сброс прерван отменой задачи, доставку сообщений подтвердить нельзя
+                    sent.set_exception(ConnectionError("Отправка сообщений в redis прервана"))
+            REDIS_BULK_PUBLISHER_FLUSH_SIZE.observe(size)
+
+    async def close(self) -> None:
+        if self._timer and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_wait)
+        await self.flush()
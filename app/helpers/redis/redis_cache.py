@@ -1,12 +1,34 @@
 import asyncio
+import dataclasses
 import functools
+import hashlib
 import logging
-import pickle
-from typing import Any, overload
+from datetime import date, datetime
+from datetime import time as dt_time
+from decimal import Decimal
+from enum import Enum
+from math import log
+from random import random
+from time import monotonic, time
+from typing import Any, Mapping, Optional, Sequence, Union, overload
+from uuid import UUID
 
+from prometheus_client import Counter
 from redis.asyncio import Redis
 
 from app.helpers.asyncio_utils import run_with_timeout
+from app.helpers.codecs import CompressedCodec, PickleCodec
+from app.helpers.redis.local_cache import MISSING, LocalCache
+
+MAX_KEY_DEPTH = 8
+
+# Счётчик общий для всех экземпляров RedisCache: повторная регистрация метрики в prometheus_client запрещена
+CACHE_REQUESTS_TOTAL = Counter(
+    name="redis_cache_requests_total",
+    documentation="Счётчик обращений к кешу: local_hit - память процесса, hit - redis, miss - промах, "
+    "coalesced - ожидание уже идущего вычисления того же ключа, refresh - фоновое обновление значения",
+    labelnames=["cache", "result"],
+)
 
 
 class RedisCache:
@@ -14,82 +36,403 @@ class RedisCache:
         self,
         redis: Redis,
         logger: logging.Logger = None,
-        serializer=pickle,
+        serializer: Any = None,
+        name: str = "default",
+        local_maxsize: int = 0,
+        local_ttl: Optional[float] = None,
+        single_flight: bool = True,
+        compression: Optional[str] = None,
+        compress_threshold: int = 1024,
     ):
+        """
+        :param redis:           клиент redis
+        :param logger:          логгер
+        :param serializer:      кодек значений с методами dumps и loads (PickleCodec, OrjsonCodec, MsgpackCodec),
+                                по умолчанию pickle протоколом 5
+        :param name:            имя кеша в метриках
+        :param local_maxsize:   количество записей LRU-кеша в памяти процесса перед redis, 0 - без него
+        :param local_ttl:       максимальное время жизни записи в памяти процесса в секундах,
+                                None - как в redis. Запись в памяти не видит изменений ключа в redis
+        :param single_flight:   пропущенный ключ вычисляет одна корутина, остальные ждут её результат
+        :param compression:     сжатие значений: zstd, lz4 или None
+        :param compress_threshold: минимальный размер сжимаемого значения в байтах
+        """
         self.redis = redis
         self.logger = logger or logging
-        self.serializer = serializer
+        self.serializer = serializer or PickleCodec()
+        if compression:
+            self.serializer = CompressedCodec(self.serializer, compression=compression, threshold=compress_threshold)
+        self.name = name
+        self.local = LocalCache(maxsize=local_maxsize, ttl=local_ttl) if local_maxsize else None
+        self.single_flight = single_flight
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._refreshing: dict[str, asyncio.Task] = {}
 
     async def set(self, key, value, timeout, expire) -> None:
+        if self.local is not None and value:
+            self.local.set(key, value, ttl=expire)
         func = self.redis.set(key, self.serializer.dumps(value), ex=expire)
         await run_with_timeout(func, timeout=timeout, operation_name="RedisCache Set", logger=self.logger)
 
     async def get(self, key, timeout) -> Any:
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not MISSING:
+                CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="local_hit").inc()
+                return value
+        if self.local is None:
+            result = await run_with_timeout(
+                self.redis.get(key),
+                timeout=timeout,
+                operation_name="RedisCache Get",
+                logger=self.logger,
+            )
+            value = self.serializer.loads(result) if result else None
+            CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="hit" if value else "miss").inc()
+            return value
+
         result = await run_with_timeout(
-            self.redis.get(key),
+            self._get_with_ttl(key),
             timeout=timeout,
             operation_name="RedisCache Get",
             logger=self.logger,
         )
-        return self.serializer.loads(result) if result else None
+        result, pttl = result or (None, None)
+        value = self.serializer.loads(result) if result else None
+        CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="hit" if value else "miss").inc()
+        if value and pttl and pttl > 0:
+            # Запись в памяти не переживает ключ в redis
+            self.local.set(key, value, ttl=pttl / 1000)
+        return value
+
+    async def _get_with_ttl(self, key) -> tuple:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            return tuple(await pipe.execute())
+
+    async def get_many(self, keys: Sequence[str], timeout) -> list:
+        """
+        Получить значения нескольких ключей: память процесса, затем один MGET для остальных
+        :param keys:        ключи
+        :param timeout:     время ожидания ответа от redis в секундах
+        :return:            значения в порядке ключей, None для отсутствующих
+        """
+        values = [None] * len(keys)
+        missing = []
+        for index, key in enumerate(keys):
+            value = self.local.get(key) if self.local is not None else MISSING
+            if value is MISSING:
+                missing.append(index)
+                continue
+            CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="local_hit").inc()
+            values[index] = value
+        if not missing:
+            return values
+
+        missing_keys = [keys[index] for index in missing]
+        result = await run_with_timeout(
+            self._get_many_with_ttl(missing_keys),
+            timeout=timeout,
+            operation_name="RedisCache Get Many",
+            logger=self.logger,
+        )
+        results, pttls = result or ([None] * len(missing_keys), [None] * len(missing_keys))
+        hits = 0
+        for index, key, data, pttl in zip(missing, missing_keys, results, pttls):
+            value = self.serializer.loads(data) if data else None
+            values[index] = value
+            if not value:
+                continue
+            hits += 1
+            if self.local is not None and pttl and pttl > 0:
+                self.local.set(key, value, ttl=pttl / 1000)
+        CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="hit").inc(hits)
+        CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="miss").inc(len(missing_keys) - hits)
+        return values
+
+    async def set_many(self, items: Mapping[str, Any], timeout, expire) -> None:
+        """
+        Записать несколько значений одним pipeline
+        :param items:       ключ -> значение
+        :param timeout:     время ожидания ответа от redis в секундах
+        :param expire:      время жизни значений в секундах
+        """
+        if not items:
+            return
+        if self.local is not None:
+            for key, value in items.items():
+                if value:
+                    self.local.set(key, value, ttl=expire)
+        await run_with_timeout(
+            self._set_many(items, expire), timeout=timeout, operation_name="RedisCache Set Many", logger=self.logger
+        )
+
+    async def _get_many_with_ttl(self, keys: list) -> tuple[list, list]:
+        # PTTL нужен только для записи в память процесса
+        if self.local is None:
+            return await self.redis.mget(keys), [None] * len(keys)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.mget(keys)
+            for key in keys:
+                pipe.pttl(key)
+            results, *pttls = await pipe.execute()
+        return results, pttls
+
+    async def _set_many(self, items: Mapping[str, Any], expire) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, self.serializer.dumps(value), ex=expire)
+            await pipe.execute()
 
     @overload
-    def cache(self, func, ttl=60, timeout=0.07, *args, **kwargs) -> Any:
+    def cache(self, func, ttl=60, timeout=0.07, *args, soft_ttl=None, beta=0.0, **kwargs) -> Any:
         """
         Кешировать результат функции
         :param func: функция
         :param ttl: время жизни кеша в секундах
         :param timeout: время ожидания ответа от redis в секундах
+        :param soft_ttl: время в секундах, после которого значение обновляется в фоне, а до обновления
+                         отдаётся устаревшее. None - без фонового обновления
+        :param beta: коэффициент вероятностного раннего обновления (XFetch), 0 - обновление только после soft_ttl
         """
         ...
 
     @overload
-    def cache(self, ttl: float = 60, timeout: float = 0.07) -> callable:
+    def cache(
+        self, ttl: float = 60, timeout: float = 0.07, *, soft_ttl: Optional[float] = None, beta: float = 0.0
+    ) -> callable:
         """
         Декоратор для кеширования функции
         :param ttl: время жизни кеша в секундах
         :param timeout: время ожидания ответа от redis в секундах
+        :param soft_ttl: время в секундах, после которого значение обновляется в фоне, а до обновления
+                         отдаётся устаревшее. None - без фонового обновления
+        :param beta: коэффициент вероятностного раннего обновления (XFetch), 0 - обновление только после soft_ttl
         """
         ...
 
-    def cache(self, ttl: float = 60, timeout: float = 0.07, *args, **kwargs):
+    def cache(
+        self,
+        ttl: float = 60,
+        timeout: float = 0.07,
+        *args,
+        soft_ttl: Optional[float] = None,
+        beta: float = 0.0,
+        **kwargs,
+    ):
+        if soft_ttl is not None and soft_ttl >= ttl:
+            raise ValueError("soft_ttl должен быть меньше ttl")
+        policy = {"timeout": timeout, "expire": ttl, "soft_expire": soft_ttl, "beta": beta}
         if func_cached := kwargs.pop("func", None):
             if asyncio.iscoroutinefunction(func_cached):
-                return self._cache_impl(func=func_cached, *args, timeout=timeout, expire=ttl, **kwargs)
+                return self._cache_impl(func=func_cached, *args, **policy, **kwargs)
             return asyncio.get_event_loop().run_until_complete(
-                self._cache_impl(func=func_cached, *args, timeout=timeout, expire=ttl, **kwargs)
+                self._cache_impl(func=func_cached, *args, **policy, **kwargs)
             )
 
         def decorator(func):
             @functools.wraps(func)
             async def async_wrapper(*local_args, **local_kwargs):
-                return await self._cache_impl(func, *local_args, timeout=timeout, expire=ttl, **local_kwargs)
+                return await self._cache_impl(func, *local_args, **policy, **local_kwargs)
 
             @functools.wraps(func)
             def sync_wrapper(*local_args, **local_kwargs):
                 return asyncio.get_event_loop().run_until_complete(
-                    self._cache_impl(func, *local_args, timeout=timeout, expire=ttl, **local_kwargs)
+                    self._cache_impl(func, *local_args, **policy, **local_kwargs)
+                )
+
+            return async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
+
+        return decorator
+
+    def cache_many(self, ttl: float = 60, timeout: float = 0.07, as_dict: bool = False) -> callable:
+        """
+        Декоратор для кеширования функции, принимающей первым аргументом список элементов и возвращающей
+        список результатов в том же порядке. Каждый элемент кешируется отдельно: попадания читаются одним MGET,
+        функция вызывается только для промахов, результаты промахов записываются одним pipeline
+        :param ttl: время жизни кеша в секундах
+        :param timeout: время ожидания ответа от redis в секундах
+        :param as_dict: функция возвращает словарь элемент -> результат, декорированная - тоже
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def async_wrapper(items, *local_args, **local_kwargs):
+                return await self._cache_many_impl(func, items, local_args, local_kwargs, timeout, ttl, as_dict)
+
+            @functools.wraps(func)
+            def sync_wrapper(items, *local_args, **local_kwargs):
+                return asyncio.get_event_loop().run_until_complete(
+                    self._cache_many_impl(func, items, local_args, local_kwargs, timeout, ttl, as_dict)
                 )
 
             return async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
 
         return decorator
 
-    async def _cache_impl(self, func, *args, timeout, expire, **kwargs) -> Any:
+    async def _cache_many_impl(
+        self, func, items: Sequence, args, kwargs, timeout, expire, as_dict: bool = False
+    ) -> Union[list, dict]:
+        items = list(items)
+        keys = [self._make_key(func, (item, *args), kwargs) for item in items]
+        values = await self.get_many(keys, timeout=timeout)
+
+        # Повторяющиеся элементы вычисляются один раз
+        missing = {}
+        for item, key, value in zip(items, keys, values):
+            if not value and key not in missing:
+                missing[key] = item
+        computed = {}
+        if missing:
+            missing_items = list(missing.values())
+            if asyncio.iscoroutinefunction(func):
+                result = await func(missing_items, *args, **kwargs)
+            else:
+                result = func(missing_items, *args, **kwargs)
+            results = [result.get(item) for item in missing_items] if as_dict else list(result)
+            if len(results) != len(missing_items):
+                raise ValueError(f"{func.__qualname__} вернула {len(results)} результатов на {len(missing_items)}")
+            computed = dict(zip(missing, results))
+            await self.set_many(
+                {key: value for key, value in computed.items() if value}, timeout=timeout, expire=expire
+            )
+
+        values = [computed.get(key, value) if not value else value for key, value in zip(keys, values)]
+        if as_dict:
+            return {item: value for item, value in zip(items, values)}
+        return values
+
+    async def _cache_impl(self, func, *args, timeout, expire, soft_expire=None, beta=0.0, **kwargs) -> Any:
         cache_key = self._make_key(func, args, kwargs)
+        if soft_expire is not None:
+            # С soft_ttl значение хранится в другом формате, ключи двух режимов одной функции не пересекаются
+            cache_key = f"{cache_key}:swr"
+        policy = {"timeout": timeout, "expire": expire, "soft_expire": soft_expire, "beta": beta}
+        if not self.single_flight:
+            return await self._get_or_compute(func, cache_key, args, kwargs, **policy)
+
+        future = self._in_flight.get(cache_key)
+        if future is not None:
+            CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="coalesced").inc()
+            await asyncio.wait([future])
+            if future.cancelled():
+                # Вычислявшая корутина отменена, значение вычисляется заново
+                return await self._cache_impl(func, *args, **policy, **kwargs)
+            return future.result()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        try:
+            result = await self._get_or_compute(func, cache_key, args, kwargs, **policy)
+        except Exception as error:
+            # Ожидающие получают ту же ошибку, а не повторяют упавший вызов
+            future.set_exception(error)
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._in_flight[cache_key]
+        return result
+
+    async def _get_or_compute(self, func, cache_key: str, args, kwargs, timeout, expire, soft_expire, beta) -> Any:
         cached_value = await self.get(key=cache_key, timeout=timeout)
+        if soft_expire is None:
+            if cached_value:
+                return cached_value
+            return await self._compute(func, cache_key, args, kwargs, timeout, expire, soft_expire)
+
+        # С soft_ttl в кеше лежит (значение, момент мягкого истечения, время вычисления)
         if cached_value:
-            return cached_value
+            value, soft_expires_at, delta = cached_value
+            if self._should_refresh(soft_expires_at, delta, beta):
+                self._refresh_later(func, cache_key, args, kwargs, timeout, expire, soft_expire, delta)
+            return value
+        return await self._compute(func, cache_key, args, kwargs, timeout, expire, soft_expire)
 
+    async def _compute(self, func, cache_key: str, args, kwargs, timeout, expire, soft_expire) -> Any:
+        started = monotonic()
         if asyncio.iscoroutinefunction(func):
             result = await func(*args, **kwargs)
         else:
             result = func(*args, **kwargs)
+        if soft_expire is None:
+            await self.set(key=cache_key, value=result, expire=expire, timeout=timeout)
+        else:
+            value = (result, time() + soft_expire, monotonic() - started)
+            await self.set(key=cache_key, value=value, expire=expire, timeout=timeout)
+        return result
 
-        await self.set(key=cache_key, value=result, expire=expire, timeout=timeout)
+    @staticmethod
+    def _should_refresh(soft_expires_at: float, delta: float, beta: float) -> bool:
+        """
+        XFetch: чем дороже вычисление (delta) и ближе мягкое истечение, тем вероятнее раннее обновление,
+        поэтому одновременно записанные ключи обновляются в разные моменты
+        """
+        if beta <= 0:
+            return time() >= soft_expires_at
+        return time() - delta * beta * log(1 - random()) >= soft_expires_at
 
-        return result
+    def _refresh_later(self, func, cache_key: str, args, kwargs, timeout, expire, soft_expire, delta) -> None:
+        if cache_key in self._refreshing:
+            return
+
+        async def refresh():
+            # Между репликами значение обновляет одна: остальные видят блокировку и отдают устаревшее
+            lock = self.redis.set(f"{cache_key}:refresh", 1, nx=True, px=max(1000, int(delta * 3000)))
+            if not await run_with_timeout(lock, timeout=timeout, operation_name="RedisCache Lock", logger=self.logger):
+                return
+            CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="refresh").inc()
+            await self._compute(func, cache_key, args, kwargs, timeout, expire, soft_expire)
+
+        task = asyncio.create_task(refresh())
+        self._refreshing[cache_key] = task
+        task.add_done_callback(lambda _task: self._on_refreshed(cache_key, _task))
+
+    def _on_refreshed(self, cache_key: str, task: asyncio.Task) -> None:
+        self._refreshing.pop(cache_key, None)
+        if not task.cancelled() and task.exception():
+            self.logger.error("Ошибка фонового обновления кеша %s: %r", cache_key, task.exception())
 
     @staticmethod
     def _make_key(func, args, kwargs) -> str:
-        return f"{func.__module__}.{func.__name__}:{args}:{kwargs}"
+        """
+        Ключ фиксированной длины: читаемое имя функции и blake2b канонического представления аргументов
+        """
+        arguments = repr((_canonical(args), _canonical(kwargs))).encode("utf-8")
+        return f"{func.__module__}.{func.__qualname__}:{hashlib.blake2b(arguments, digest_size=16).hexdigest()}"
+
+
+def _canonical(value: Any, depth: int = 0) -> Any:
+    """
+    Представление аргумента, не зависящее от порядка ключей словарей и множеств и от адресов объектов в памяти.
+    Глубже MAX_KEY_DEPTH и для функций и классов учитывается только тип или имя
+    """
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return value
+    if depth > MAX_KEY_DEPTH:
+        return type(value).__qualname__
+    depth += 1
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(item, depth) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((repr(_canonical(key, depth)), _canonical(item, depth)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(repr(_canonical(item, depth)) for item in value))
+    if isinstance(value, Enum):
+        return _canonical(value.value, depth)
+    if isinstance(value, (datetime, date, dt_time, Decimal, UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return type(value).__qualname__, _canonical(dataclasses.asdict(value), depth)
+    if hasattr(value, "model_dump") and not isinstance(value, type):
+        return type(value).__qualname__, _canonical(value.model_dump(), depth)
+    if isinstance(value, type) or callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', type(value).__qualname__)}"
+    if hasattr(value, "__dict__"):
+        return type(value).__qualname__, _canonical(vars(value), depth)
+    return repr(value)
@@ -1,14 +1,13 @@
 import asyncio
 import logging
 import traceback
-from typing import Any, AsyncGenerator, Union
+from typing import Any, Optional, Union
 
 import async_timeout
-from redis import ConnectionError
+from redis import ConnectionError, ResponseError
 from redis.asyncio import Redis
 from tenacity import retry, wait_random
 
-from app.helpers.asyncio_utils import run_in_executor
 from app.helpers.redis.redis_amqp_abc import MessageRedisAbc, RedisAmqpAbc
 
 
@@ -19,9 +18,18 @@ class RedisQueueAmqp(RedisAmqpAbc):
         logger: logging.Logger = logging,
         listening_periodicity: float = 0.01,
         timeout: int = 10,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
+        block_timeout: Optional[float] = None,
         **kwargs,
     ):
-        super().__init__(redis, logger, listening_periodicity, timeout, **kwargs)
+        """
+        :param block_timeout:   режим блокирующего чтения (BLPOP/BLMPOP) с таймаутом ожидания на стороне redis
+                                в секундах, None - опрос LPOP с паузой listening_periodicity
+        """
+        super().__init__(redis, logger, listening_periodicity, timeout, concurrency, rate_limit, **kwargs)
+        self.block_timeout = block_timeout
+        self._blmpop_supported = True
 
     async def init_queue(self, routing_key: str, **kwargs) -> None:
         """
@@ -33,18 +41,22 @@ class RedisQueueAmqp(RedisAmqpAbc):
         return
 
     async def send(self, message: Union[str, bytes, list, dict], routing_key: str, **kwargs) -> None:
-        await self.redis.rpush(routing_key, message)
+        await self.redis.rpush(routing_key, self.convert_message(message, self.codec))
         self.logger.debug("Отправка сообщения в очередь %s прошла успешно", routing_key)
 
     async def init_consumer(self, routing_key: str, on_message: callable, **kwargs) -> None:
-        asyncio.create_task(retry(wait=wait_random(min=1, max=10))(self.consumer_callback)(routing_key, on_message))
+        self.run_consumer(retry(wait=wait_random(min=1, max=10))(self.consumer_callback)(routing_key, on_message))
         self.logger.info("Инициализация слушателя очереди %s прошла успешно", routing_key)
 
     async def get_message(self, routing_key: str) -> Any:
         while True:
             try:
-                async with async_timeout.timeout(self.timeout):
-                    message = await self.redis.lpop(routing_key)
+                async with async_timeout.timeout(self.timeout + (self.block_timeout or 0)):
+                    if self.block_timeout:
+                        message = await self.redis.blpop([routing_key], timeout=self.block_timeout)
+                        message = message[1] if message else None
+                    else:
+                        message = await self.redis.lpop(routing_key)
             except ConnectionError as error:
                 self.logger.error("Ошибка подключения к Redis, reasons: %s", error)
                 raise error
@@ -53,7 +65,53 @@ class RedisQueueAmqp(RedisAmqpAbc):
                 continue
             if message:
                 return message
-            await asyncio.sleep(self.listening_periodicity)
+            if not self.block_timeout:
+                await asyncio.sleep(self.listening_periodicity)
+
+    async def get_messages(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> list:
+        """
+        Получить пачку сообщений из очереди: ждёт первое сообщение и забирает до max_count одним запросом
+        :param routing_key:             название очереди
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений на стороне redis в секундах,
+                                        по умолчанию block_timeout, без него - опрос LPOP
+        :return:                        список сообщений
+        """
+        block_timeout = max_wait if max_wait is not None else self.block_timeout
+        while True:
+            try:
+                async with async_timeout.timeout(self.timeout + (block_timeout or 0)):
+                    if block_timeout:
+                        messages = await self._blocking_pop_many(routing_key, max_count, block_timeout)
+                    else:
+                        messages = await self.redis.lpop(routing_key, count=max_count)
+            except ConnectionError as error:
+                self.logger.error("Ошибка подключения к Redis, reasons: %s", error)
+                raise error
+            except asyncio.TimeoutError:
+                self.logger.warning("Превышено время ожидания сообщения из Redis")
+                continue
+            if messages:
+                return messages
+            if not block_timeout:
+                await asyncio.sleep(self.listening_periodicity)
+
+    async def _blocking_pop_many(self, routing_key: str, max_count: int, block_timeout: float) -> Optional[list]:
+        if self._blmpop_supported:
+            try:
+                result = await self.redis.blmpop(block_timeout, 1, routing_key, direction="LEFT", count=max_count)
+                return result[1] if result else None
+            except ResponseError as error:
+                # BLMPOP появился в Redis 7.0, на старых версиях ждём BLPOP и добираем пачку LPOP с count
+                self.logger.warning("BLMPOP недоступен, используется BLPOP + LPOP: %s", error)
+                self._blmpop_supported = False
+        result = await self.redis.blpop([routing_key], timeout=block_timeout)
+        if not result:
+            return None
+        messages = [result[1]]
+        if max_count > 1:
+            messages.extend(await self.redis.lpop(routing_key, count=max_count - 1) or [])
+        return messages
 
 
 class MessageRedisQueue(MessageRedisAbc):
@@ -75,12 +133,23 @@ class MessageRedisQueue(MessageRedisAbc):
     async def ack(self):
         return
 
-    async def rollback(self):
-        await self.redis.lpush(self.routing_key, self.body)
+    async def rollback(self, error: Optional[BaseException] = None):
+        if self.retry_queue:
+            await self.retry_queue.fail(self.routing_key, self.body, error)
+            return
+        # В конец очереди, а не в начало: иначе сбойное сообщение читается снова без паузы
+        await self.redis.rpush(self.routing_key, self.body)
         self.logger.debug("MessageRedisQueue :: сообщение возвращено обратно в очередь")
 
 
 class RedisQueueShieldAmqp(RedisQueueAmqp):
+    def __init__(self, *args, retry_queue: Any = None, **kwargs):
+        """
+        :param retry_queue:     RedisRetryQueue для откатываемых сообщений: повтор с задержкой и dead letter list
+        """
+        super().__init__(*args, **kwargs)
+        self.retry_queue = retry_queue
+
     async def consumer_callback(self, routing_key: str, on_message: callable):
         """
         Слушатель сообщений из очереди
@@ -90,16 +159,17 @@ class RedisQueueShieldAmqp(RedisQueueAmqp):
         while True:
             message: MessageRedisAbc = await self.get_message(routing_key)
             self.logger.debug("Обработка сообщения из очереди %s...", routing_key)
+            # Ошибка не перезапускает слушателя: сообщение уже откачено через rollback и не должно
+            # сразу же читаться снова
             try:
                 if asyncio.iscoroutinefunction(on_message):
                     await on_message(message)
                 else:
-                    await run_in_executor(message, executor=None, loop=self.loop, func=on_message)
+                    await asyncio.to_thread(on_message, message)
                 self.logger.debug("Обработка сообщения из очереди %s прошла успешно", routing_key)
             except:  # noqa
                 self.logger.error("Ошибка при обработки сообщения из очереди %s", routing_key)
                 self.logger.error(traceback.format_exc())
-                raise
 
     async def get_message(self, routing_key: str) -> Any:
         while True:
@@ -114,29 +184,25 @@ class RedisQueueShieldAmqp(RedisQueueAmqp):
                 continue
             if message:
                 return MessageRedisQueue(
-                    redis=self.redis, body=message, rollback_on_error=True, routing_key=routing_key
+                    redis=self.redis,
+                    body=message,
+                    rollback_on_error=True,
+                    routing_key=routing_key,
+                    retry_queue=self.retry_queue,
                 )
             await asyncio.sleep(self.listening_periodicity)
 
     async def get_messages(
-        self, routing_key: str, batch_size: int = 1, **kwargs
-    ) -> AsyncGenerator[MessageRedisAbc, None]:
-        while True:
-            try:
-                async with async_timeout.timeout(self.timeout):
-                    messages = await self.redis.lpop(routing_key, count=batch_size, **kwargs)
-            except ConnectionError as error:
-                self.logger.error("Ошибка подключения к Redis, reasons: %s", error)
-                raise error
-            except asyncio.TimeoutError:
-                self.logger.warning("Превышено время ожидания сообщения из Redis")
-                continue
-            if messages:
-                for message in messages:
-                    handled_message = MessageRedisQueue(
-                        redis=self.redis, body=message, rollback_on_error=True, routing_key=routing_key
-                    )
-                    yield handled_message
-                return
-
-            await asyncio.sleep(self.listening_periodicity)
+        self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None
+    ) -> list[MessageRedisAbc]:
+        messages = await super().get_messages(routing_key, max_count=max_count, max_wait=max_wait)
+        return [
+            MessageRedisQueue(
+                redis=self.redis,
+                body=message,
+                rollback_on_error=True,
+                routing_key=routing_key,
+                retry_queue=self.retry_queue,
+            )
+            for message in messages
+        ]
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Optional, Sequence
+
+import async_timeout
+from redis import ConnectionError
+from redis.asyncio import Redis
+
+from app.helpers.asyncio_utils import scheduled_task
+from app.helpers.redis.redis_queue_amqp import RedisQueueAmqp
+
+# Переносит до ARGV[1] сообщений из очереди в список обработки консьюмера ARGV[3] и назначает им срок
+# видимости ARGV[2]. ARGV[4] - сообщение, уже перенесённое BLMOVE, ему назначается срок и пачка добирается до ARGV[1]
+POP_SCRIPT = """
+redis.call('SADD', KEYS[4], ARGV[3])
+local messages = {}
+if ARGV[4] then
+    table.insert(messages, ARGV[4])
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[4])
+end
+while #messages < tonumber(ARGV[1]) do
+    local message = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not message then
+        break
+    end
+    redis.call('ZADD', KEYS[3], ARGV[2], message)
+    table.insert(messages, message)
+end
+return messages
+"""
+
+# Удаляет обработанные сообщения из списка обработки, срок видимости снимается с последней копией сообщения
+ACK_SCRIPT = """
+for _, message in ipairs(ARGV) do
+    redis.call('LREM', KEYS[1], 1, message)
+    if not redis.call('LPOS', KEYS[1], message) then
+        redis.call('ZREM', KEYS[2], message)
+    end
+end
+return #ARGV
+"""
+
+# Возвращает в начало очереди сообщения с истёкшим сроком видимости (ARGV[1] - текущее время).
+# Сообщениям без срока (процесс упал между BLMOVE и POP_SCRIPT) назначается срок ARGV[2].
+# Консьюмер ARGV[3] с пустым списком обработки снимается с учёта, если ARGV[4] == '1'
+REAP_SCRIPT = """
+for _, message in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    redis.call('ZADD', KEYS[3], 'NX', ARGV[2], message)
+end
+local requeued = 0
+for _, message in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])) do
+    local count = redis.call('LREM', KEYS[2], 0, message)
+    for _ = 1, count do
+        redis.call('LPUSH', KEYS[1], message)
+    end
+    redis.call('ZREM', KEYS[3], message)
+    requeued = requeued + count
+end
+if ARGV[4] == '1' and redis.call('LLEN', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[4], ARGV[3])
+end
+return requeued
+"""
+
+
+class RedisReliableQueueAmqp(RedisQueueAmqp):
+    """
+    Очередь redis (list) с доставкой at-least-once.
+    Сообщение атомарно переносится из очереди в список обработки консьюмера (LMOVE/BLMOVE) и получает срок
+    видимости в ZSET; после успешной обработки callback'ом сообщение подтверждается удалением из списка.
+    Фоновый reaper возвращает в очередь сообщения с истёкшим сроком видимости, в том числе из списков
+    обработки упавших процессов
+    """
+
+    redelivers = True
+
+    def __init__(
+        self,
+        redis: Redis = None,
+        logger: logging.Logger = logging,
+        listening_periodicity: float = 0.01,
+        timeout: int = 10,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
+        block_timeout: Optional[float] = None,
+        visibility_timeout: float = 60,
+        reap_interval: float = 10,
+        consumer_name: Optional[str] = None,
+        **kwargs,
+    ):
+        """
+        :param visibility_timeout:      время в секундах, после которого неподтверждённое сообщение
+                                        возвращается в очередь
+        :param reap_interval:           периодичность проверки просроченных сообщений в секундах
+        :param consumer_name:           имя консьюмера, по умолчанию hostname:pid
+        """
+        super().__init__(
+            redis, logger, listening_periodicity, timeout, concurrency, rate_limit, block_timeout, **kwargs
+        )
+        self.visibility_timeout = visibility_timeout
+        self.reap_interval = reap_interval
+        self.consumer_name = consumer_name or f"{socket.gethostname()}:{os.getpid()}"
+        self._pop_script = self.redis.register_script(POP_SCRIPT)
+        self._ack_script = self.redis.register_script(ACK_SCRIPT)
+        self._reap_script = self.redis.register_script(REAP_SCRIPT)
+        self._reapers: dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def consumers_key(routing_key: str) -> str:
+        return f"{routing_key}:consumers"
+
+    @staticmethod
+    def processing_key(routing_key: str, consumer_name: str) -> str:
+        return f"{routing_key}:processing:{consumer_name}"
+
+    @staticmethod
+    def deadlines_key(routing_key: str, consumer_name: str) -> str:
+        return f"{routing_key}:processing:{consumer_name}:deadlines"
+
+    async def init_queue(self, routing_key: str, **kwargs) -> None:
+        await self.redis.sadd(self.consumers_key(routing_key), self.consumer_name)
+        if routing_key not in self._reapers:
+            self._reapers[routing_key] = scheduled_task(
+                lambda: self.reap(routing_key), repeat_timeout=self.reap_interval, logger=self.logger
+            )
+
+    async def init_consumer(self, routing_key: str, on_message: callable, **kwargs) -> None:
+        await self.init_queue(routing_key)
+        await super().init_consumer(routing_key, on_message, **kwargs)
+
+    async def init_batch_consumer(self, routing_key: str, on_messages: callable, **kwargs) -> None:
+        await self.init_queue(routing_key)
+        await super().init_batch_consumer(routing_key, on_messages, **kwargs)
+
+    async def close(self) -> None:
+        # Reaper останавливается после обработчиков: их сообщения успевают подтвердиться
+        await super().close()
+        for task in self._reapers.values():
+            task.cancel()
+        self._reapers.clear()
+
+    async def get_message(self, routing_key: str) -> Any:
+        return (await self.get_messages(routing_key, max_count=1))[0]
+
+    async def get_messages(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> list:
+        """
+        Получить пачку сообщений, перенеся их в список обработки консьюмера
+        :param routing_key:             название очереди
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений на стороне redis в секундах,
+                                        по умолчанию block_timeout, без него - опрос очереди
+        :return:                        список сообщений, каждое нужно подтвердить через ack
+        """
+        block_timeout = max_wait if max_wait is not None else self.block_timeout
+        while True:
+            try:
+                async with async_timeout.timeout(self.timeout + (block_timeout or 0)):
+                    messages = await self._move(routing_key, max_count)
+                    if not messages and block_timeout:
+                        message = await self.redis.blmove(
+                            routing_key,
+                            self.processing_key(routing_key, self.consumer_name),
+                            block_timeout,
+                            src="LEFT",
+                            dest="RIGHT",
+                        )
+                        if message is not None:
+                            messages = await self._move(routing_key, max_count, moved=message)
+            except ConnectionError as error:
+                self.logger.error("Ошибка подключения к Redis, reasons: %s", error)
+                raise error
+            except asyncio.TimeoutError:
+                self.logger.warning("Превышено время ожидания сообщения из Redis")
+                continue
+            if messages:
+                return messages
+            if not block_timeout:
+                await asyncio.sleep(self.listening_periodicity)
+
+    async def receive(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> tuple:
+        # Сообщения, обработка которых упала, не подтверждаются и вернутся в очередь после visibility_timeout
+        messages = await self.get_messages(routing_key, max_count=max_count, max_wait=max_wait)
+        return self.decode_messages(messages), messages
+
+    async def ack(self, routing_key: str, messages: Sequence[Any]) -> None:
+        """
+        Подтвердить обработку сообщений
+        :param routing_key:             название очереди
+        :param messages:                сообщения, полученные через get_message(s)
+        """
+        if not messages:
+            return
+        await self._ack_script(
+            keys=[
+                self.processing_key(routing_key, self.consumer_name),
+                self.deadlines_key(routing_key, self.consumer_name),
+            ],
+            args=list(messages),
+        )
+
+    async def reap(self, routing_key: str) -> int:
+        """
+        Вернуть в очередь сообщения с истёкшим сроком видимости из списков обработки всех консьюмеров
+        :param routing_key:             название очереди
+        :return:                        количество возвращённых сообщений
+        """
+        now = time.time()
+        requeued = 0
+        consumers_key = self.consumers_key(routing_key)
+        for consumer_name in await self.redis.smembers(consumers_key):
+            if isinstance(consumer_name, bytes):
+                consumer_name = consumer_name.decode("utf-8")
+            requeued += await self._reap_script(
+                keys=[
+                    routing_key,
+                    self.processing_key(routing_key, consumer_name),
+                    self.deadlines_key(routing_key, consumer_name),
+                    consumers_key,
+                ],
+                args=[now, now + self.visibility_timeout, consumer_name, int(consumer_name != self.consumer_name)],
+            )
+        if requeued:
+            self.logger.warning("В очередь %s возвращено %s просроченных сообщений", routing_key, requeued)
+        return requeued
+
+    async def _move(self, routing_key: str, max_count: int, moved: Any = None) -> list:
+        args = [max_count, time.time() + self.visibility_timeout, self.consumer_name]
+        if moved is not None:
+            args.append(moved)
+        return await self._pop_script(
+            keys=[
+                routing_key,
+                self.processing_key(routing_key, self.consumer_name),
+                self.deadlines_key(routing_key, self.consumer_name),
+                self.consumers_key(routing_key),
+            ],
+            args=args,
+        )
@@ -0,0 +1,237 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Optional
+
+from redis.asyncio import Redis
+
+from app.helpers.asyncio_utils import scheduled_task
+from app.helpers.codecs import JsonCodec
+from app.helpers.interfaces import AmqpAbc, CodecAbc
+
+# Атомарно переносит из отложенной очереди KEYS[1] в ZSET отправляемых KEYS[2] до ARGV[2] сообщений, срок
+# которых наступил к ARGV[1], со сроком отправки ARGV[3]: из нескольких реплик каждое сообщение забирает одна.
+# Сообщения, не отправленные к своему сроку (процесс упал между захватом и отправкой), сначала возвращаются
+# в отложенную очередь
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, envelope in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], envelope)
+    redis.call('ZADD', KEYS[1], ARGV[1], envelope)
+end
+local envelopes = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, envelope in ipairs(envelopes) do
+    redis.call('ZREM', KEYS[1], envelope)
+    redis.call('ZADD', KEYS[2], ARGV[3], envelope)
+end
+return envelopes
+"""
+
+
+class RedisRetryQueue:
+    """
+    Повторная обработка сообщений, обработка которых упала.
+    Количество попыток считается по хэшу содержимого сообщения, счётчик каждого сообщения живёт attempts_ttl
+    после последней неудачи. Упавшее сообщение откладывается в ZSET с экспоненциальной задержкой и возвращается
+    в исходную очередь фоновой задачей, после max_attempts попыток - попадает в dead letter list, откуда его
+    можно посмотреть и переотправить. Из отложенной очереди и dead letter list сообщение удаляется только
+    после отправки, при сбое оно может быть доставлено повторно, но не теряется.
+    Сообщение хранится в конверте в том виде, в каком уходит в очередь (dict и list - через codec), в base64:
+    так в JSON-конверт попадают и бинарные сообщения msgpack или сжатых кодеков
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        amqp: AmqpAbc,
+        max_attempts: int = 5,
+        base_delay: float = 1,
+        max_delay: float = 300,
+        poll_interval: float = 1,
+        attempts_ttl: int = 86400,
+        claim_timeout: float = 60,
+        codec: Optional[CodecAbc] = None,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param redis:               клиент redis
+        :param amqp:                клиент очереди, через который сообщения возвращаются на обработку
+        :param max_attempts:        количество попыток обработки до попадания в dead letter list
+        :param base_delay:          задержка перед второй попыткой в секундах, дальше удваивается
+        :param max_delay:           максимальная задержка в секундах
+        :param poll_interval:       периодичность проверки отложенных сообщений в секундах
+        :param attempts_ttl:        время хранения счётчика попыток сообщения в секундах
+        :param claim_timeout:       время на отправку забранных сообщений в секундах, после него
+                                    неотправленные сообщения снова забираются на отправку
+        :param codec:               кодек сообщений очереди, по умолчанию json
+        :param logger:              логгер
+        """
+        self.redis = redis
+        self.amqp = amqp
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.attempts_ttl = attempts_ttl
+        self.claim_timeout = claim_timeout
+        self.codec = codec or JsonCodec()
+        self.logger = logger or logging
+        self._claim_script = self.redis.register_script(CLAIM_SCRIPT)
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def delayed_key(routing_key: str) -> str:
+        return f"{routing_key}:delayed"
+
+    @staticmethod
+    def dead_letter_key(routing_key: str) -> str:
+        return f"{routing_key}:dead"
+
+    @staticmethod
+    def claimed_key(routing_key: str) -> str:
+        return f"{routing_key}:delayed:claimed"
+
+    @staticmethod
+    def attempts_key(routing_key: str, digest: str) -> str:
+        return f"{routing_key}:attempts:{digest}"
+
+    @staticmethod
+    def digest(message: Any) -> str:
+        if not isinstance(message, (str, bytes)):
+            message = json.dumps(message, sort_keys=True)
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        return hashlib.blake2b(message, digest_size=16).hexdigest()
+
+    def envelope(self, message: Any, error: BaseException, attempts: int) -> str:
+        payload = AmqpAbc.convert_message(message, self.codec)
+        return json.dumps(
+            {
+                "payload": base64.b64encode(payload).decode("ascii"),
+                "attempts": attempts,
+                "error": repr(error),
+                "failed_at": time.time(),
+            }
+        )
+
+    @staticmethod
+    def payload(envelope: dict) -> Any:
+        # Конверты старого формата хранят сообщение как есть в поле message
+        if "payload" not in envelope:
+            return envelope["message"]
+        return base64.b64decode(envelope["payload"])
+
+    def decode_payload(self, payload: Any) -> Any:
+        if not isinstance(payload, bytes):
+            return payload
+        try:
+            return self.codec.loads(payload)
+        except Exception:  # noqa
+            # Сообщение, которое не разобрал кодек (например, попавшее в dead letter при разборе), показывается текстом
+            return payload.decode("utf-8", "replace")
+
+    async def start(self, routing_key: str) -> None:
+        if routing_key not in self._tasks:
+            self._tasks[routing_key] = scheduled_task(
+                lambda: self.requeue_due(routing_key), repeat_timeout=self.poll_interval, logger=self.logger
+            )
+
+    async def close(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def fail(self, routing_key: str, message: Any, error: BaseException) -> None:
+        """
+        Учесть неудачную попытку обработки сообщения: отложить его или отправить в dead letter list
+        :param routing_key:     исходная очередь сообщения
+        :param message:         сообщение
+        :param error:           ошибка обработки
+        """
+        attempts_key = self.attempts_key(routing_key, self.digest(message))
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.incr(attempts_key)
+            pipe.expire(attempts_key, self.attempts_ttl)
+            attempts, _ = await pipe.execute()
+        if attempts >= self.max_attempts:
+            await self.dead_letter(routing_key, message, error, attempts=attempts)
+            await self.redis.delete(attempts_key)
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        envelope = self.envelope(message, error, attempts)
+        await self.redis.zadd(self.delayed_key(routing_key), {envelope: time.time() + delay})
+        self.logger.warning("Повторная обработка сообщения через %s с, попытка %s", delay, attempts + 1)
+
+    async def dead_letter(self, routing_key: str, message: Any, error: BaseException, attempts: int = 1) -> None:
+        """
+        Отправить сообщение в dead letter list без повторов, например если его невозможно разобрать
+        :param routing_key:     исходная очередь сообщения
+        :param message:         сообщение
+        :param error:           ошибка обработки
+        :param attempts:        количество сделанных попыток
+        """
+        await self.redis.rpush(self.dead_letter_key(routing_key), self.envelope(message, error, attempts))
+        self.logger.error("Сообщение отправлено в %s после %s попыток", self.dead_letter_key(routing_key), attempts)
+
+    async def requeue_due(self, routing_key: str, batch_size: int = 100) -> int:
+        """
+        Вернуть в исходную очередь отложенные сообщения, срок которых наступил
+        :param routing_key:     исходная очередь
+        :param batch_size:      количество сообщений, забираемых за один запрос
+        :return:                количество возвращённых сообщений
+        """
+        requeued = 0
+        while True:
+            now = time.time()
+            envelopes = await self._claim_script(
+                keys=[self.delayed_key(routing_key), self.claimed_key(routing_key)],
+                args=[now, batch_size, now + self.claim_timeout],
+            )
+            for envelope in envelopes:
+                await self.amqp.send(self.payload(json.loads(envelope)), routing_key)
+                await self.redis.zrem(self.claimed_key(routing_key), envelope)
+            requeued += len(envelopes)
+            if len(envelopes) < batch_size:
+                return requeued
+
+    async def dead_letters(self, routing_key: str, offset: int = 0, limit: int = 100) -> list[dict]:
+        """
+        Сообщения из dead letter list, от старых к новым
+        :param routing_key:     исходная очередь
+        :param offset:          смещение
+        :param limit:           количество
+        """
+        envelopes = await self.redis.lrange(self.dead_letter_key(routing_key), offset, offset + limit - 1)
+        return [
+            {
+                "message": self.decode_payload(self.payload(envelope)),
+                "attempts": envelope["attempts"],
+                "error": envelope["error"],
+                "failed_at": envelope["failed_at"],
+            }
+            for envelope in map(json.loads, envelopes)
+        ]
+
+    async def dead_letters_count(self, routing_key: str) -> int:
+        return await self.redis.llen(self.dead_letter_key(routing_key))
+
+    async def replay(self, routing_key: str, count: Optional[int] = None) -> int:
+        """
+        Переотправить сообщения из dead letter list в исходную очередь со сброшенным счётчиком попыток
+        :param routing_key:     исходная очередь
+        :param count:           количество самых старых сообщений, None - все
+        :return:                количество переотправленных сообщений
+        """
+        replayed = 0
+        while count is None or replayed < count:
+            envelope = await self.redis.lindex(self.dead_letter_key(routing_key), 0)
+            if envelope is None:
+                break
+            await self.amqp.send(self.payload(json.loads(envelope)), routing_key)
+            await self.redis.lrem(self.dead_letter_key(routing_key), 1, envelope)
+            replayed += 1
+        self.logger.info("Из %s переотправлено %s сообщений", self.dead_letter_key(routing_key), replayed)
+        return replayed
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import zlib
+from typing import Any, Optional, Sequence, Union
+
+from app.helpers.asyncio_utils import scheduled_task
+from app.helpers.interfaces import AmqpAbc
+from app.helpers.redis.redis_amqp_abc import RedisAmqpAbc
+
+# Захватывает или продлевает аренду шарда ARGV[1] на ARGV[2] мс, чужую действующую аренду не трогает
+LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Снимает аренду шарда, только если она принадлежит ARGV[1]
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisShardedAmqp(AmqpAbc):
+    """
+    Шардирование очереди redis по ключу сообщения (по умолчанию client_id) поверх RedisReliableQueueAmqp
+    или RedisStreamAmqp с подтверждением. Чтение шарда прерывается при перебалансировке, поэтому транспорт
+    должен сам возвращать неподтверждённые сообщения (redelivers): RedisQueueAmqp такие сообщения теряет.
+    Сообщение отправляется в одну из shards подочередей {routing_key}:shard:{n} по crc32 ключа, поэтому все
+    сообщения одного клиента попадают в один шард. Процессы-консьюмеры регистрируются в ZSET участников и
+    делят шарды между собой по номеру в отсортированном списке; шард читает только процесс, владеющий его
+    арендой в redis, пачки шарда обрабатываются строго последовательно. При перебалансировке аренда
+    освобождается после обработки текущей пачки, так что порядок внутри шарда сохраняется.
+    Сообщения, отправленные на повтор через RedisRetryQueue, и сообщения упавшего процесса, возвращённые
+    по visibility_timeout, обрабатываются уже после более новых сообщений клиента
+    """
+
+    def __init__(
+        self,
+        amqp: RedisAmqpAbc,
+        shards: int = 8,
+        shard_field: str = "client_id",
+        rebalance_interval: float = 5,
+        lease_ttl: Optional[float] = None,
+        consumer_name: Optional[str] = None,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param amqp:                    транспорт, через который читаются и пишутся подочереди шардов
+        :param shards:                  количество шардов, должно совпадать у всех продюсеров и консьюмеров
+        :param shard_field:             поле сообщения, по которому выбирается шард
+        :param rebalance_interval:      периодичность продления аренды и перераспределения шардов в секундах
+        :param lease_ttl:               время жизни аренды шарда и регистрации процесса в секундах,
+                                        по умолчанию три rebalance_interval
+        :param consumer_name:           имя процесса-консьюмера, по умолчанию hostname:pid
+        :param logger:                  логгер
+        """
+        if not amqp.redelivers:
+            raise ValueError(
+                f"{type(amqp).__name__} не возвращает неподтверждённые сообщения, для шардирования нужен "
+                "транспорт reliable_queue или stream с подтверждением"
+            )
+        self.amqp = amqp
+        self.redis = amqp.redis
+        self.shards = shards
+        self.shard_field = shard_field
+        self.rebalance_interval = rebalance_interval
+        self.lease_ttl = lease_ttl or rebalance_interval * 3
+        self.consumer_name = consumer_name or f"{socket.gethostname()}:{os.getpid()}"
+        self.logger = logger or logging
+        self._lease_script = self.redis.register_script(LEASE_SCRIPT)
+        self._release_script = self.redis.register_script(RELEASE_SCRIPT)
+        self._initialized: set[str] = set()
+        self._handlers: dict[str, tuple] = {}
+        self._rebalancers: dict[str, asyncio.Task] = {}
+        self._workers: dict[tuple[str, int], tuple[asyncio.Task, asyncio.Event]] = {}
+
+    @staticmethod
+    def shard_key(routing_key: str, shard: int) -> str:
+        return f"{routing_key}:shard:{shard}"
+
+    @staticmethod
+    def lease_key(routing_key: str, shard: int) -> str:
+        return f"{routing_key}:shard:{shard}:lease"
+
+    @staticmethod
+    def members_key(routing_key: str) -> str:
+        return f"{routing_key}:shard_members"
+
+    def shard_of(self, message: Union[str, bytes, list, dict]) -> int:
+        """
+        Номер шарда сообщения. crc32 вместо hash(): номер не должен зависеть от процесса и PYTHONHASHSEED
+        :param message:     сообщение
+        :return:            номер шарда
+        """
+        if isinstance(message, (str, bytes)):
+            try:
+                message = self.amqp.codec.loads(message) if self.amqp.codec else json.loads(message)
+            except Exception:  # noqa
+                message = None
+        key = message.get(self.shard_field) if isinstance(message, dict) else None
+        return zlib.crc32(str(key).encode("utf-8")) % self.shards
+
+    async def init_queue(self, routing_key: str, **kwargs) -> None:
+        if routing_key in self._initialized:
+            return
+        for shard in range(self.shards):
+            await self.amqp.init_queue(self.shard_key(routing_key, shard), **kwargs)
+        self._initialized.add(routing_key)
+
+    async def send(self, message: Union[str, bytes, list, dict], routing_key: str, **kwargs) -> None:
+        await self.amqp.send(message, self.shard_key(routing_key, self.shard_of(message)), **kwargs)
+
+    async def send_many(self, messages: Sequence[Union[str, bytes, list, dict]], routing_key: str, **kwargs) -> None:
+        """
+        Отправка пачки сообщений: сообщения группируются по шардам с сохранением порядка
+        :param messages:            сообщения
+        :param routing_key:         название очереди
+        """
+        by_shard: dict[int, list] = {}
+        for message in messages:
+            by_shard.setdefault(self.shard_of(message), []).append(message)
+        for shard, shard_messages in by_shard.items():
+            shard_key = self.shard_key(routing_key, shard)
+            if hasattr(self.amqp, "send_many"):
+                await self.amqp.send_many(shard_messages, shard_key, **kwargs)
+                continue
+            for message in shard_messages:
+                await self.amqp.send(message, shard_key, **kwargs)
+
+    async def get_message(self, routing_key: str) -> Any:
+        """
+        Получить сообщение из шарда без учёта аренды
+        :param routing_key:             ключ шарда, см. shard_key
+        """
+        return await self.amqp.get_message(routing_key)
+
+    async def get_messages(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> list:
+        """
+        Получить пачку сообщений из шарда без учёта аренды
+        :param routing_key:             ключ шарда, см. shard_key
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                время ожидания сообщений в секундах
+        """
+        return await self.amqp.get_messages(routing_key, max_count=max_count, max_wait=max_wait)
+
+    async def init_consumer(self, routing_key: str, on_message: callable, **kwargs) -> None:
+        await self._start(routing_key, on_message, max_count=1, max_wait=None, batch=False)
+
+    async def init_batch_consumer(
+        self, routing_key: str, on_messages: callable, max_count: int = 100, max_wait: Optional[float] = None, **kwargs
+    ) -> None:
+        await self._start(routing_key, on_messages, max_count=max_count, max_wait=max_wait, batch=True)
+
+    async def close(self) -> None:
+        for task in self._rebalancers.values():
+            task.cancel()
+        for _task, stop in self._workers.values():
+            stop.set()
+        workers = [task for task, _stop in self._workers.values()]
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+        for routing_key in self._rebalancers:
+            await self.redis.zrem(self.members_key(routing_key), self.consumer_name)
+        self._rebalancers.clear()
+        await self.amqp.close()
+
+    def owned_shards(self, routing_key: str) -> list[int]:
+        return sorted(shard for key, shard in self._workers if key == routing_key)
+
+    async def rebalance(self, routing_key: str) -> None:
+        """
+        Продлить регистрацию процесса и аренды его шардов, отпустить чужие по распределению шарды
+        и захватить свободные свои
+        :param routing_key:             название очереди
+        """
+        now = time.time()
+        members_key = self.members_key(routing_key)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(members_key, {self.consumer_name: now})
+            pipe.zremrangebyscore(members_key, "-inf", now - self.lease_ttl)
+            pipe.zrange(members_key, 0, -1)
+            *_, members = await pipe.execute()
+        members = sorted(member.decode("utf-8") if isinstance(member, bytes) else member for member in members)
+        index = members.index(self.consumer_name)
+        lease_ms = int(self.lease_ttl * 1000)
+
+        for shard in range(self.shards):
+            assigned = shard % len(members) == index
+            worker = self._workers.get((routing_key, shard))
+            if worker is None and not assigned:
+                continue
+            # Аренда продлевается и у останавливаемого шарда: её нельзя потерять до конца текущей пачки
+            leased = await self._lease_script(
+                keys=[self.lease_key(routing_key, shard)], args=[self.consumer_name, lease_ms]
+            )
+            if worker is not None:
+                _task, stop = worker
+                if not leased:
+                    self.logger.warning("Потеряна аренда шарда %s очереди %s", shard, routing_key)
+                if (not leased or not assigned) and not stop.is_set():
+                    stop.set()
+            elif leased:
+                self._run_worker(routing_key, shard)
+
+    async def _start(
+        self, routing_key: str, callback: callable, max_count: int, max_wait: Optional[float], batch: bool
+    ) -> None:
+        await self.init_queue(routing_key)
+        self._handlers[routing_key] = (callback, max_count, max_wait, batch)
+        if routing_key not in self._rebalancers:
+            self._rebalancers[routing_key] = scheduled_task(
+                lambda: self.rebalance(routing_key), repeat_timeout=self.rebalance_interval, logger=self.logger
+            )
+        self.logger.info(
+            "Инициализация слушателя шардов очереди %s (%s шардов) прошла успешно", routing_key, self.shards
+        )
+
+    def _run_worker(self, routing_key: str, shard: int) -> None:
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._consume_shard(routing_key, shard, stop))
+        self._workers[(routing_key, shard)] = (task, stop)
+
+        def on_done(_task: asyncio.Task) -> None:
+            self._workers.pop((routing_key, shard), None)
+            if not _task.cancelled() and _task.exception():
+                self.logger.error(
+                    "Слушатель шарда %s очереди %s остановлен с ошибкой: %r", shard, routing_key, _task.exception()
+                )
+
+        task.add_done_callback(on_done)
+        self.logger.info("Шард %s очереди %s назначен консьюмеру %s", shard, routing_key, self.consumer_name)
+
+    async def _consume_shard(self, routing_key: str, shard: int, stop: asyncio.Event) -> None:
+        shard_key = self.shard_key(routing_key, shard)
+        callback, max_count, max_wait, batch = self._handlers[routing_key]
+        try:
+            while not stop.is_set():
+                receiving = asyncio.ensure_future(self.amqp.receive(shard_key, max_count=max_count, max_wait=max_wait))
+                stopping = asyncio.ensure_future(stop.wait())
+                await asyncio.wait({receiving, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                stopping.cancel()
+                if not receiving.done():
+                    # Неподтверждённые сообщения прерванного чтения транспорт вернёт в шард сам (redelivers)
+                    receiving.cancel()
+                    break
+                messages, receipt = receiving.result()
+                if self.amqp.rate_limiter:
+                    await self.amqp.rate_limiter.acquire(len(messages))
+                await self.amqp.handle_message(shard_key, callback, messages if batch else messages[0], receipt)
+        finally:
+            await self._release_script(keys=[self.lease_key(routing_key, shard)], args=[self.consumer_name])
+            self.logger.info("Шард %s очереди %s освобождён консьюмером %s", shard, routing_key, self.consumer_name)
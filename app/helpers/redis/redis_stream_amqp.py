@@ -1,7 +1,8 @@
 import asyncio
 import logging
 import traceback
-from typing import Any, AsyncGenerator, Union
+from time import monotonic
+from typing import Any, Optional, Sequence, Union
 from uuid import uuid4
 
 import async_timeout
@@ -9,9 +10,10 @@ from redis import ConnectionError, ResponseError
 from redis.asyncio import Redis
 from tenacity import retry, wait_random
 
-from app.helpers.asyncio_utils import run_in_executor
 from app.helpers.redis.redis_amqp_abc import MessageRedisAbc, RedisAmqpAbc
 
+PAYLOAD_FIELD = "payload"
+
 
 class RedisStreamAmqp(RedisAmqpAbc):
     def __init__(
@@ -23,13 +25,39 @@ class RedisStreamAmqp(RedisAmqpAbc):
         listening_periodicity: float = 0.01,
         timeout: int = 10,
         noack: bool = False,
+        concurrency: int = 1,
+        rate_limit: Optional[float] = None,
+        block_timeout: Optional[float] = None,
+        claim_idle_time: Optional[float] = 60,
+        claim_interval: float = 10,
+        length_check_interval: float = 5,
         **kwargs,
     ):
+        """
+        :param group_name:              consumer group, реплики с одной группой делят поток между собой
+        :param consumer_name:           имя консьюмера в группе
+        :param noack:                   чтение без добавления в список ожидающих подтверждения (PEL)
+        :param block_timeout:           таймаут блокирующего XREADGROUP в секундах, None - опрос с паузой
+                                        listening_periodicity
+        :param claim_idle_time:         время в секундах, после которого неподтверждённые сообщения других
+                                        консьюмеров забираются через XAUTOCLAIM, None - не забирать
+        :param claim_interval:          периодичность проверки неподтверждённых сообщений в секундах
+        :param length_check_interval:   периодичность проверки переполнения потока при отправке в секундах
+        """
         self.group_name = group_name
         self.consumer_name = consumer_name or str(uuid4())
         self.queues_extra = {}
         self.noack = noack
-        super().__init__(redis, logger, listening_periodicity, timeout, **kwargs)
+        self.block_timeout = block_timeout
+        self.claim_idle_time = claim_idle_time
+        self.claim_interval = claim_interval
+        self._next_claim: dict[str, float] = {}
+        self._claim_cursor: dict[str, str] = {}
+        self.length_check_interval = length_check_interval
+        self._next_length_check: dict[str, float] = {}
+        super().__init__(redis, logger, listening_periodicity, timeout, concurrency, rate_limit, **kwargs)
+        # Неподтверждённые сообщения остаются в PEL и забираются через XAUTOCLAIM
+        self.redelivers = not noack and claim_idle_time is not None
 
     async def init_queue(self, routing_key: str, **kwargs):
         self.queues_extra[routing_key] = kwargs or {}
@@ -44,23 +72,62 @@ class RedisStreamAmqp(RedisAmqpAbc):
     async def send(
         self, message: Union[str, bytes, list, dict], routing_key: str, max_len: int = 1000, **kwargs
     ) -> None:
-        await self.redis.xadd(routing_key, message, maxlen=max_len)
+        await self.redis.xadd(routing_key, self._encode(message), maxlen=max_len, approximate=True)
         self.logger.debug("Отправка сообщения в очередь %s прошла успешно", routing_key)
+        await self._check_length(routing_key, max_len)
+
+    async def send_many(self, messages: Sequence[dict], routing_key: str, max_len: int = 1000, **kwargs) -> None:
+        """
+        Отправка пачки сообщений одним pipeline XADD с приблизительной обрезкой потока (MAXLEN ~)
+        :param messages:            сообщения
+        :param routing_key:         название очереди
+        :param max_len:             приблизительная максимальная длина потока
+        """
+        if not messages:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for message in messages:
+                pipe.xadd(routing_key, self._encode(message), maxlen=max_len, approximate=True)
+            await pipe.execute()
+        self.logger.debug("Отправка %s сообщений в очередь %s прошла успешно", len(messages), routing_key)
+        await self._check_length(routing_key, max_len)
+
+    def _encode(self, message: Union[str, bytes, list, dict]) -> dict:
+        # С кодеком сообщение целиком лежит в одном поле записи потока
+        if self.codec:
+            return {PAYLOAD_FIELD: self.convert_message(message, self.codec)}
+        return message
+
+    def decode_messages(self, messages: list) -> list:
+        if not self.codec:
+            return messages
+        return super().decode_messages(
+            [data.get(PAYLOAD_FIELD, data.get(PAYLOAD_FIELD.encode(), data)) for data in messages]
+        )
+
+    async def _check_length(self, routing_key: str, max_len: int) -> None:
+        # Длина потока проверяется не чаще раза в length_check_interval, а не после каждой отправки
+        now = monotonic()
+        if now < self._next_length_check.get(routing_key, 0):
+            return
+        self._next_length_check[routing_key] = now + self.length_check_interval
         message_count = await self.redis.xlen(routing_key)
         if message_count >= max_len:
             self.logger.warning("Очередь %s переполнена", routing_key)
 
     async def init_consumer(self, routing_key: str, on_message: callable, **kwargs) -> None:
-        asyncio.create_task(retry(wait=wait_random(min=1, max=10))(self.consumer_callback)(routing_key, on_message))
+        self.run_consumer(retry(wait=wait_random(min=1, max=10))(self.consumer_callback)(routing_key, on_message))
         self.logger.info("Инициализация слушателя очереди %s прошла успешно", routing_key)
 
     async def _get_message(self, routing_key: str, **kwargs):
+        block = kwargs.get("block")
         try:
-            async with async_timeout.timeout(self.timeout):
+            async with async_timeout.timeout(self.timeout + (block or 0) / 1000):
                 message = await self.redis.xreadgroup(
                     groupname=self.group_name,
                     consumername=self.consumer_name,
                     streams={routing_key: ">"},
+                    noack=self.noack,
                     **kwargs,
                 )
                 return message
@@ -74,30 +141,86 @@ class RedisStreamAmqp(RedisAmqpAbc):
             await self.init_queue(routing_key, **self.queues_extra.get(routing_key, {}))
 
     async def get_message(self, routing_key: str, **kwargs) -> Any:
-        while True:
-            message = await self._get_message(routing_key, count=1, **kwargs)
-            if message:
-                [[_stream, [[message_id, data]]]] = message
-                await self.redis.xack(routing_key, self.group_name, message_id)
-                await self.redis.xdel(routing_key, message_id)
-                return data
-            await asyncio.sleep(self.listening_periodicity)
+        return (await self.get_messages(routing_key, max_count=1))[0]
 
-    async def get_messages(self, routing_key: str, batch_size: int = 1, **kwargs) -> list:
+    async def get_messages(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> list:
+        """
+        Получить пачку сообщений, сообщения подтверждаются и удаляются из потока сразу при получении
+        :param routing_key:             название очереди
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                таймаут блокирующего чтения в секундах, по умолчанию block_timeout
+        :return:                        список сообщений
+        """
+        messages, message_ids = await self.receive(routing_key, max_count=max_count, max_wait=max_wait)
+        await self.ack(routing_key, message_ids)
+        return messages
+
+    async def receive(self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None) -> tuple:
+        """
+        Получить пачку сообщений одним XREADGROUP. Сообщения остаются в PEL группы до ack, сообщения
+        упавших консьюмеров забираются через XAUTOCLAIM после claim_idle_time
+        :param routing_key:             название очереди
+        :param max_count:               максимальный размер пачки
+        :param max_wait:                таймаут блокирующего чтения в секундах, по умолчанию block_timeout
+        :return:                        (список сообщений, список их id)
+        """
+        block_timeout = max_wait if max_wait is not None else self.block_timeout
+        block = int(block_timeout * 1000) if block_timeout else None
         while True:
-            messages = await self._get_message(routing_key, count=batch_size, **kwargs)
-            if messages:
-                message_ids = []
-                result = []
-                for _stream, entries in messages:
-                    for message_id, data in entries:
-                        message_ids.append(message_id)
-                        result.append(data)
-                await self.redis.xack(routing_key, self.group_name, *message_ids)
-                await self.redis.xdel(routing_key, *message_ids)
-                return result
+            entries = await self._claim(routing_key, max_count)
+            if not entries:
+                response = await self._get_message(routing_key, count=max_count, block=block)
+                entries = [entry for _stream, stream_entries in response or [] for entry in stream_entries]
+            if entries:
+                messages = self.decode_messages([data for _message_id, data in entries])
+                return messages, [message_id for message_id, _data in entries]
+            if not block:
+                await asyncio.sleep(self.listening_periodicity)
 
-            await asyncio.sleep(self.listening_periodicity)
+    async def ack(self, routing_key: str, message_ids: list) -> None:
+        """
+        Подтвердить и удалить сообщения одним pipeline XACK + XDEL
+        :param routing_key:             название очереди
+        :param message_ids:             id сообщений
+        """
+        if not message_ids:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xack(routing_key, self.group_name, *message_ids)
+            pipe.xdel(routing_key, *message_ids)
+            await pipe.execute()
+
+    async def _claim(self, routing_key: str, max_count: int) -> list:
+        if self.noack or self.claim_idle_time is None:
+            return []
+        now = monotonic()
+        if now < self._next_claim.get(routing_key, 0):
+            return []
+        try:
+            cursor, entries, *_deleted = await self.redis.xautoclaim(
+                routing_key,
+                self.group_name,
+                self.consumer_name,
+                min_idle_time=int(self.claim_idle_time * 1000),
+                start_id=self._claim_cursor.get(routing_key, "0-0"),
+                count=max_count,
+            )
+        except ResponseError:
+            # Группы ещё нет, она создаётся при первом чтении
+            self._next_claim[routing_key] = now + self.claim_interval
+            return []
+        self._claim_cursor[routing_key] = cursor
+        # Пока курсор не обошёл весь PEL, следующая проверка выполняется сразу
+        if cursor in ("0-0", b"0-0"):
+            self._next_claim[routing_key] = now + self.claim_interval
+        # Удалённые из потока сообщения Redis 6.2 возвращает с пустыми данными, их остаётся только подтвердить
+        orphaned = [message_id for message_id, data in entries if data is None]
+        if orphaned:
+            await self.ack(routing_key, orphaned)
+        entries = [(message_id, data) for message_id, data in entries if data is not None]
+        if entries:
+            self.logger.warning("Из PEL очереди %s забрано %s неподтверждённых сообщений", routing_key, len(entries))
+        return entries
 
 
 class MessageRedisStream(MessageRedisAbc):
@@ -125,12 +248,22 @@ class MessageRedisStream(MessageRedisAbc):
         await self.redis.xack(self.routing_key, self.group_name, self.message_id)
         self.logger.debug("MessageRedisStream :: сообщение подтверждено")
 
-    async def rollback(self):
+    async def rollback(self, error: Optional[BaseException] = None):
+        if self.retry_queue:
+            await self.retry_queue.fail(self.routing_key, self.body, error)
+            return
         await self.redis.xadd(self.routing_key, self.body)
         self.logger.debug("MessageRedisStream :: сообщение возвращено обратно в очередь")
 
 
 class RedisStreamShieldAmqp(RedisStreamAmqp):
+    def __init__(self, *args, retry_queue: Any = None, **kwargs):
+        """
+        :param retry_queue:     RedisRetryQueue для откатываемых сообщений: повтор с задержкой и dead letter list
+        """
+        super().__init__(*args, **kwargs)
+        self.retry_queue = retry_queue
+
     async def consumer_callback(self, routing_key: str, on_message: callable):
         """
         Слушатель сообщений из очереди
@@ -140,36 +273,17 @@ class RedisStreamShieldAmqp(RedisStreamAmqp):
         while True:
             message: MessageRedisAbc = await self.get_message(routing_key)
             self.logger.debug("Обработка сообщения из очереди %s...", routing_key)
+            # Ошибка не перезапускает слушателя: сообщение уже откачено через rollback и не должно
+            # сразу же читаться снова
             try:
                 if asyncio.iscoroutinefunction(on_message):
                     await on_message(message)
                 else:
-                    await run_in_executor(message, executor=None, loop=self.loop, func=on_message)
+                    await asyncio.to_thread(on_message, message)
                 self.logger.debug("Обработка сообщения из очереди %s прошла успешно", routing_key)
             except:  # noqa
                 self.logger.error("Ошибка при обработки сообщения из очереди %s", routing_key)
                 self.logger.error(traceback.format_exc())
-                raise
-
-    async def _get_message(self, routing_key: str, **kwargs):
-        try:
-            async with async_timeout.timeout(self.timeout):
-                message = await self.redis.xreadgroup(
-                    groupname=self.group_name,
-                    consumername=self.consumer_name,
-                    streams={routing_key: ">"},
-                    noack=self.noack,
-                    **kwargs,
-                )
-                return message
-        except ConnectionError as error:
-            self.logger.error("Ошибка подключения к Redis, reasons: %s", error)
-            raise error
-        except asyncio.TimeoutError:
-            self.logger.warning("Превышено время ожидания сообщения из Redis")
-        except ResponseError:
-            self.logger.warning("Очереди %s не найдено в Redis", routing_key)
-            await self.init_queue(routing_key, **self.queues_extra.get(routing_key, {}))
 
     async def get_message(self, routing_key: str, **kwargs) -> Any:
         while True:
@@ -182,29 +296,33 @@ class RedisStreamShieldAmqp(RedisStreamAmqp):
                     body=data,
                     noack=self.noack,
                     rollback_on_error=True,
+                    retry_queue=self.retry_queue,
                     routing_key=routing_key,
                     group_name=self.group_name,
                 )
             await asyncio.sleep(self.listening_periodicity)
 
     async def get_messages(
-        self, routing_key: str, batch_size: int = 1, **kwargs
-    ) -> AsyncGenerator[MessageRedisAbc, None]:
+        self, routing_key: str, max_count: int = 100, max_wait: Optional[float] = None
+    ) -> list[MessageRedisAbc]:
+        block_timeout = max_wait if max_wait is not None else self.block_timeout
+        block = int(block_timeout * 1000) if block_timeout else None
         while True:
-            messages = await self._get_message(routing_key, count=batch_size, **kwargs)
+            messages = await self._get_message(routing_key, count=max_count, block=block)
             if messages:
-                for _stream, entries in messages:
-                    for message_id, data in entries:
-                        handled_message = MessageRedisStream(
-                            redis=self.redis,
-                            message_id=message_id,
-                            body=data,
-                            noack=self.noack,
-                            rollback_on_error=self.rollback_on_error,
-                            routing_key=routing_key,
-                            group_name=self.group_name,
-                        )
-                        yield handled_message
-                return
-
-            await asyncio.sleep(self.listening_periodicity)
+                return [
+                    MessageRedisStream(
+                        redis=self.redis,
+                        message_id=message_id,
+                        body=data,
+                        noack=self.noack,
+                        rollback_on_error=True,
+                        retry_queue=self.retry_queue,
+                        routing_key=routing_key,
+                        group_name=self.group_name,
+                    )
+                    for _stream, entries in messages
+                    for message_id, data in entries
+                ]
+            if not block:
+                await asyncio.sleep(self.listening_periodicity)
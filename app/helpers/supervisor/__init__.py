@@ -1,4 +1,6 @@
+from app.helpers.supervisor.queue_backlog import QueueBacklog
 from app.helpers.supervisor.supervisor import Supervisor
+from app.helpers.supervisor.supervisor_autoscaler import SupervisorAutoscaler
 from app.helpers.supervisor.supervisor_subprocess import SupervisorSubProcess
 
-__all__ = ["Supervisor", "SupervisorSubProcess"]
+__all__ = ["Supervisor", "SupervisorSubProcess", "SupervisorAutoscaler", "QueueBacklog"]
@@ -64,7 +64,12 @@ class HealthCheckApp:
                 process_status: list[ProcessStatusOut] = list()
                 for process in supervisor_subprocesses.values():
                     status = ProcessStatusOut(
-                        status=False, name=process.name, processes_num_plan=process.process_count, processes_num_alive=0
+                        status=False,
+                        name=process.name,
+                        processes_num_plan=process.process_count,
+                        processes_num_alive=0,
+                        processes_num_min=process.autoscaler.min_process_count if process.autoscaler else None,
+                        processes_num_max=process.autoscaler.max_process_count if process.autoscaler else None,
                     )
                     process_status.append(status)
                 return process_status
@@ -0,0 +1,57 @@
+import logging
+from typing import Optional, Sequence
+
+from redis import Redis, ResponseError
+
+
+class QueueBacklog:
+    """
+    Размер очереди сообщений в redis для автомасштабирования: сумма по всем routing_keys.
+    Список (list) - LLEN; поток (stream) - lag consumer group плюс её PEL (XPENDING), а если группы нет или
+    Redis не считает lag (до 7.0, после XDEL) - XLEN
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        routing_keys: Sequence[str],
+        group_name: Optional[str] = None,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param redis:           синхронный клиент redis, supervisor работает вне event loop
+        :param routing_keys:    очереди; для шардированной очереди - ключи всех шардов
+        :param group_name:      consumer group потоков
+        :param logger:          логгер
+        """
+        self.redis = redis
+        self.routing_keys = list(routing_keys)
+        self.group_name = group_name
+        self.logger = logger or logging
+
+    def __call__(self) -> int:
+        return sum(self.sample(routing_key) for routing_key in self.routing_keys)
+
+    def sample(self, routing_key: str) -> int:
+        """
+        :param routing_key:     название очереди
+        :return:                количество необработанных сообщений
+        """
+        key_type = self.redis.type(routing_key)
+        if isinstance(key_type, bytes):
+            key_type = key_type.decode("utf-8")
+        if key_type == "list":
+            return self.redis.llen(routing_key)
+        if key_type != "stream":
+            return 0
+        if self.group_name:
+            try:
+                groups = self.redis.xinfo_groups(routing_key)
+            except ResponseError:
+                groups = []
+            for group in groups:
+                name = group["name"].decode("utf-8") if isinstance(group["name"], bytes) else group["name"]
+                if name == self.group_name and group.get("lag") is not None:
+                    pending = self.redis.xpending(routing_key, self.group_name)["pending"]
+                    return group["lag"] + pending
+        return self.redis.xlen(routing_key)
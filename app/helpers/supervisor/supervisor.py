@@ -93,12 +93,15 @@ class Supervisor:
                     )
                 )
                 supervisor_subprocess: SupervisorSubProcess = self.supervisor_subprocesses[supervisor_process_name]
+                if supervisor_subprocess.autoscaler:
+                    self._autoscale(supervisor_process_name)
                 history_data.append(
                     {
                         "status": True,
                         "name": supervisor_process_name,
                         "processes_num_plan": self.supervisor_subprocesses[supervisor_process_name].process_count,
                         "processes_num_alive": len(self._supervisor_processes[supervisor_process_name]),
+                        **self._autoscaling_status(supervisor_subprocess),
                     }
                 )
                 while len(self._supervisor_processes[supervisor_process_name]) < supervisor_subprocess.process_count:
@@ -113,6 +116,34 @@ class Supervisor:
                 history_data.pop(0)
             sleep(self.timeout_periodicity)
 
+    def _autoscale(self, supervisor_process_name: str) -> None:
+        """
+        Обновить запланированное количество процессов по размеру очереди и остановить лишние процессы,
+        недостающие запускаются основным циклом
+        :param supervisor_process_name:     имя процесса
+        """
+        supervisor_subprocess: SupervisorSubProcess = self.supervisor_subprocesses[supervisor_process_name]
+        supervisor_subprocess.process_count = supervisor_subprocess.autoscaler.target(
+            supervisor_subprocess.process_count
+        )
+        processes = self._supervisor_processes[supervisor_process_name]
+        while len(processes) > supervisor_subprocess.process_count:
+            # Останавливаются самые новые процессы; неподтверждённые сообщения вернёт в очередь транспорт
+            process: Process = processes.pop()
+            logging.info("Остановка процесса %s, pid %s", supervisor_process_name, process.pid)
+            process.terminate()
+
+    @staticmethod
+    def _autoscaling_status(supervisor_subprocess: SupervisorSubProcess) -> dict:
+        autoscaler = supervisor_subprocess.autoscaler
+        if not autoscaler:
+            return {}
+        return {
+            "processes_num_min": autoscaler.min_process_count,
+            "processes_num_max": autoscaler.max_process_count,
+            "backlog": autoscaler.last_backlog,
+        }
+
     def run(self, block=False):
         self.process = Process(target=self._run)
         self.process.start()
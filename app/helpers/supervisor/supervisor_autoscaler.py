@@ -0,0 +1,87 @@
+import logging
+from math import ceil
+from time import monotonic
+from typing import Callable, Optional
+
+
+class SupervisorAutoscaler:
+    """
+    Выбор количества процессов SupervisorSubProcess по размеру очереди.
+    Размер очереди на процесс выше scale_up_backlog - процессов добавляется столько, чтобы на каждый пришлась
+    середина между порогами; ниже scale_down_backlog - процессы снимаются по одному. Разрыв между порогами
+    (гистерезис) и паузы после изменения (cooldown) не дают количеству процессов колебаться на всплесках
+    """
+
+    def __init__(
+        self,
+        backlog: Callable[[], int],
+        min_process_count: int = 1,
+        max_process_count: int = 8,
+        scale_up_backlog: int = 1000,
+        scale_down_backlog: int = 100,
+        scale_up_cooldown: float = 30,
+        scale_down_cooldown: float = 120,
+        sample_interval: float = 5,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param backlog:                 функция, возвращающая размер очереди, например QueueBacklog
+        :param min_process_count:       минимальное количество процессов
+        :param max_process_count:       максимальное количество процессов
+        :param scale_up_backlog:        размер очереди на процесс, выше которого процессы добавляются
+        :param scale_down_backlog:      размер очереди на процесс, ниже которого процессы снимаются
+        :param scale_up_cooldown:       пауза после изменения количества процессов перед добавлением в секундах
+        :param scale_down_cooldown:     пауза после изменения количества процессов перед снятием в секундах
+        :param sample_interval:         периодичность замера очереди в секундах
+        :param logger:                  логгер
+        """
+        if not 0 < min_process_count <= max_process_count:
+            raise ValueError("Должно выполняться 0 < min_process_count <= max_process_count")
+        if scale_down_backlog >= scale_up_backlog:
+            raise ValueError("scale_down_backlog должен быть меньше scale_up_backlog")
+        self.backlog = backlog
+        self.min_process_count = min_process_count
+        self.max_process_count = max_process_count
+        self.scale_up_backlog = scale_up_backlog
+        self.scale_down_backlog = scale_down_backlog
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.sample_interval = sample_interval
+        self.logger = logger or logging
+        self.last_backlog: Optional[int] = None
+        self._next_sample = 0.0
+        # Отсчёт cooldown начинается с запуска: первые замеры после старта не меняют количество процессов
+        self._last_scale = monotonic()
+
+    def clamp(self, process_count: int) -> int:
+        return min(self.max_process_count, max(self.min_process_count, process_count))
+
+    def target(self, process_count: int) -> int:
+        """
+        Целевое количество процессов. Очередь замеряется не чаще sample_interval, между замерами
+        и при ошибке замера возвращается текущее количество
+        :param process_count:   текущее запланированное количество процессов
+        :return:                новое запланированное количество процессов
+        """
+        process_count = self.clamp(process_count)
+        now = monotonic()
+        if now < self._next_sample:
+            return process_count
+        self._next_sample = now + self.sample_interval
+        try:
+            backlog = self.backlog()
+        except Exception as error:
+            self.logger.warning("Не удалось получить размер очереди: %r", error)
+            return process_count
+        self.last_backlog = backlog
+
+        per_process = backlog / process_count
+        target = process_count
+        if per_process > self.scale_up_backlog and now - self._last_scale >= self.scale_up_cooldown:
+            target = self.clamp(ceil(backlog / ((self.scale_up_backlog + self.scale_down_backlog) / 2)))
+        elif per_process < self.scale_down_backlog and now - self._last_scale >= self.scale_down_cooldown:
+            target = self.clamp(process_count - 1)
+        if target != process_count:
+            self._last_scale = now
+            self.logger.info("Размер очереди %s, количество процессов %s -> %s", backlog, process_count, target)
+        return target
@@ -7,6 +7,8 @@ from typing import Optional
 
 from setproctitle import setproctitle
 
+from app.helpers.supervisor.supervisor_autoscaler import SupervisorAutoscaler
+
 
 class SupervisorSubProcess:
     def __init__(
@@ -16,10 +18,16 @@ class SupervisorSubProcess:
         process_count: int,
         target_args: Optional[tuple] = None,
         target_kwargs: Optional[dict] = None,
+        autoscaler: Optional[SupervisorAutoscaler] = None,
         **kwargs,
     ):
+        """
+        :param process_count:   количество процессов, с автомасштабированием - начальное
+        :param autoscaler:      автомасштабирование количества процессов по размеру очереди
+        """
         self.name = name
-        self.process_count = process_count
+        self.autoscaler = autoscaler
+        self.process_count = autoscaler.clamp(process_count) if autoscaler else process_count
         self.target = target
         self.target_args = target_args or ()
         self.target_kwargs = target_kwargs or {}
@@ -0,0 +1,175 @@
+from typing import Any, Optional, Sequence
+
+import joblib
+import numpy as np
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from app.workers.feature_encoder import model_input
+
+TREE_LEAF = -1
+
+
+class CompiledForest:
+    """
+    Ансамбль деревьев-классификаторов, развёрнутый в непрерывные массивы узлов.
+    Все деревья обходятся одновременно векторными операциями numpy, без валидации входа
+    и поэлементного вызова деревьев sklearn. Листья зациклены сами на себя, поэтому
+    обход делает ровно max_depth шагов для любого дерева.
+    Пропуски обходятся по missing_go_to_left узла, как в sklearn. Вместе с именами признаков этого хватает,
+    чтобы скорить без исходной модели
+    """
+
+    # Вид объекта в кэше ModelStore, меняется вместе с набором полей, чтобы не читать кэш старого формата
+    cache_kind = "compiled-v2"
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int,
+        missing_left: Optional[np.ndarray] = None,
+        allow_missing: bool = False,
+        feature_names: Optional[Sequence[str]] = None,
+    ):
+        """
+        :param feature:         индекс признака узла
+        :param threshold:       порог узла, переход влево при x <= threshold
+        :param left:            глобальный индекс левого потомка
+        :param right:           глобальный индекс правого потомка
+        :param value:           нормированные вероятности классов узла (n_nodes, n_classes)
+        :param roots:           глобальные индексы корней деревьев
+        :param max_depth:       максимальная глубина деревьев
+        :param missing_left:    переход влево при пропуске в признаке узла
+        :param allow_missing:   модель принимает пропуски, иначе вход с NaN отклоняется как в sklearn
+        :param feature_names:   имена признаков модели (feature_names_in_)
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.missing_left = np.zeros(len(feature), dtype=bool) if missing_left is None else missing_left
+        self.allow_missing = allow_missing
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names, dtype=object)
+
+    @classmethod
+    def from_model(cls, model: Any) -> "CompiledForest":
+        if isinstance(model, (RandomForestClassifier, ExtraTreesClassifier)):
+            estimators = model.estimators_
+        elif isinstance(model, DecisionTreeClassifier):
+            estimators = [model]
+        else:
+            raise TypeError(f"Компиляция модели {type(model).__name__} не поддерживается")
+        if model.n_outputs_ != 1:
+            raise TypeError("Компиляция моделей с несколькими выходами не поддерживается")
+
+        features, thresholds, lefts, rights, missing_lefts, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == TREE_LEAF
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+            missing_lefts.append(np.asarray(getattr(tree, "missing_go_to_left", np.zeros(tree.node_count)), dtype=bool))
+            # Как DecisionTreeClassifier.predict_proba: доли классов листа с защитой от нулевой суммы
+            value = tree.value[:, 0, : model.n_classes_].astype(np.float64)
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+            roots.append(offset)
+            offset += tree.node_count
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            value=np.concatenate(values),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max(estimator.tree_.max_depth for estimator in estimators),
+            missing_left=np.concatenate(missing_lefts),
+            allow_missing=cls._allows_missing(model),
+            feature_names=getattr(model, "feature_names_in_", None),
+        )
+
+    @classmethod
+    def from_path(cls, path: str) -> "CompiledForest":
+        return cls.from_model(joblib.load(path))
+
+    @staticmethod
+    def _allows_missing(model: Any) -> bool:
+        # Поддержка пропусков зависит от типа модели и версии sklearn, спрашиваем у самой модели
+        try:
+            model.predict_proba(model_input(model, np.full((1, model.n_features_in_), np.nan)))
+        except ValueError:
+            return False
+        return True
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """
+        :param features:    матрица признаков (n_samples, n_features)
+        :return:            вероятности классов (n_samples, n_classes)
+        """
+        # sklearn сравнивает float32-признаки с float64-порогами, повторяем то же приведение
+        features = np.asarray(features, dtype=np.float32)
+        has_missing = bool(np.isnan(features).any())
+        if has_missing and not self.allow_missing:
+            raise ValueError("Input X contains NaN")
+        rows = np.arange(features.shape[0])[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], features.shape[0], axis=0)
+        for _ in range(self.max_depth):
+            values = features[rows, self.feature[nodes]]
+            go_left = values <= self.threshold[nodes]
+            if has_missing:
+                go_left |= np.isnan(values) & self.missing_left[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        leaf_values = self.value[nodes]
+        # Суммирование по деревьям в том же порядке, что и у RandomForestClassifier, даёт побитовое совпадение
+        proba = np.zeros((features.shape[0], self.value.shape[1]), dtype=np.float64)
+        for tree_index in range(len(self.roots)):
+            proba += leaf_values[:, tree_index]
+        proba /= len(self.roots)
+        return proba
+
+    def verification_features(self, n_features: int, n_samples: int = 256, seed: int = 0) -> np.ndarray:
+        """
+        Синтетические входы для проверки эквивалентности: значения признаков берутся из порогов деревьев
+        со сдвигом в обе стороны, чтобы пройти обе ветви узлов
+        :param n_features:  количество признаков модели
+        :param n_samples:   количество строк
+        :param seed:        seed генератора
+        """
+        generator = np.random.default_rng(seed)
+        features = np.zeros((n_samples, n_features), dtype=np.float64)
+        is_split = np.isfinite(self.threshold)
+        for column in range(n_features):
+            thresholds = self.threshold[is_split & (self.feature == column)]
+            if not thresholds.size:
+                continue
+            picked = generator.choice(thresholds, size=n_samples)
+            features[:, column] = picked + generator.choice([-1.0, 1.0], size=n_samples) * np.maximum(
+                np.abs(picked) * 1e-6, 1e-3
+            )
+        if self.allow_missing:
+            # Во второй половине строк часть признаков пропущена, чтобы пройти и ветви missing_go_to_left
+            missing = generator.random(features.shape) < 0.2
+            missing[: n_samples // 2] = False
+            features[missing] = np.nan
+        return features
+
+    def is_equivalent(self, model: Any, features: np.ndarray) -> bool:
+        """
+        Проверка побитового совпадения с model.predict_proba
+        :param model:       исходная модель
+        :param features:    матрица признаков
+        """
+        return bool(np.array_equal(self.predict_proba(features), model.predict_proba(model_input(model, features))))
@@ -0,0 +1,160 @@
+import ipaddress
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+FEATURE_COLUMNS = (
+    "ip",
+    "device_id",
+    "tran_code",
+    "mcc",
+    "client_id",
+    "pin_inc_count",
+    "expiration_date",
+    "datetime",
+    "sum",
+    "balance",
+    "device_type_ATM",
+    "device_type_Portable term",
+    "device_type_atm",
+    "device_type_cash_in",
+    "device_type_cash_out",
+    "device_type_port_trm",
+    "device_type_pos trm",
+    "device_type_prtbl trm",
+    "oper_type_add_on_acc",
+    "oper_type_bad",
+    "oper_type_blk",
+    "oper_type_blocked",
+    "oper_type_country_transfer",
+    "oper_type_decrease_on_acc",
+    "oper_type_diff_cntry",
+    "oper_type_err",
+    "oper_type_err_code",
+    "oper_type_from_acc",
+    "oper_type_in",
+    "oper_type_in_acc",
+    "oper_type_out",
+    "oper_type_payment",
+    "oper_type_transfer",
+    "card_status_act",
+    "card_status_active",
+    "card_status_blk",
+    "card_status_blocked",
+    "card_type_CREDIT",
+    "card_type_DEBIT",
+)
+CATEGORICAL_FEATURES = ("device_type", "oper_type", "card_status", "card_type")
+NUMERIC_FEATURES = (
+    "ip",
+    "device_id",
+    "tran_code",
+    "mcc",
+    "client_id",
+    "pin_inc_count",
+    "expiration_date",
+    "datetime",
+    "sum",
+    "balance",
+)
+
+
+def ip_to_int(value: str) -> int:
+    return int(ipaddress.IPv4Address(value))
+
+
+def to_timestamp(value: Any) -> float:
+    # pd.Timestamp даёт ту же секунду эпохи, что и pd.to_datetime(...).apply(lambda x: x.timestamp())
+    return pd.Timestamp(value).timestamp()
+
+
+CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    "ip": ip_to_int,
+    "datetime": to_timestamp,
+    "expiration_date": to_timestamp,
+}
+
+
+def model_input(model: Any, features: np.ndarray) -> Any:
+    """
+    Матрица признаков для predict_proba модели: модели, обученной на DataFrame, передаётся DataFrame
+    с её колонками, иначе sklearn предупреждает об отсутствии имён признаков на каждом вызове
+    :param model:       модель sklearn
+    :param features:    матрица признаков в порядке колонок модели
+    """
+    columns = getattr(model, "feature_names_in_", None)
+    if columns is None:
+        return features
+    return pd.DataFrame(features, columns=columns, copy=False)
+
+
+class FeatureEncoder:
+    """
+    Скомпилированный препроцессинг транзакции в вектор признаков модели.
+    Повторяет pd.get_dummies + reindex по колонкам модели, но без создания DataFrame:
+    каждое значение категориального признака заранее сопоставлено с индексом колонки.
+    """
+
+    def __init__(self, columns: Sequence[str] = FEATURE_COLUMNS, dtype: np.dtype = np.float64):
+        """
+        :param columns:     порядок колонок, на которых обучена модель
+        :param dtype:       тип элементов результирующей матрицы (float64 или float32)
+        """
+        self.columns = tuple(columns)
+        self.dtype = np.dtype(dtype)
+        self._numeric: list[tuple[int, str, Optional[Callable[[Any], Any]]]] = []
+        self._categorical: dict[str, dict[str, int]] = {feature: {} for feature in CATEGORICAL_FEATURES}
+        for index, column in enumerate(self.columns):
+            if column in NUMERIC_FEATURES:
+                self._numeric.append((index, column, CONVERTERS.get(column)))
+                continue
+            for feature in CATEGORICAL_FEATURES:
+                if column.startswith(f"{feature}_"):
+                    self._categorical[feature][column[len(feature) + 1 :]] = index
+                    break
+            else:
+                raise ValueError(f"Неизвестная колонка модели {column!r}")
+
+    @property
+    def n_features(self) -> int:
+        return len(self.columns)
+
+    def transform_one(self, record: dict, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Преобразование одной транзакции в вектор признаков
+        :param record:      транзакция
+        :param out:         заранее выделенный вектор длины n_features
+        :return:            вектор признаков
+        """
+        if out is None:
+            out = np.zeros(self.n_features, dtype=self.dtype)
+        else:
+            out.fill(0)
+        for index, column, converter in self._numeric:
+            if converter:
+                out[index] = converter(record[column])
+                continue
+            value = record.get(column, 0)
+            out[index] = np.nan if value is None else value
+        for feature, mapping in self._categorical.items():
+            value = record.get(feature)
+            if value is None:
+                continue
+            index = mapping.get(value if isinstance(value, str) else str(value))
+            if index is not None:
+                out[index] = 1
+        return out
+
+    def transform(self, records: Sequence[dict], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Преобразование пачки транзакций в матрицу признаков
+        :param records:     транзакции
+        :param out:         заранее выделенная матрица (len(records), n_features)
+        :return:            матрица признаков
+        """
+        if out is None:
+            out = np.empty((len(records), self.n_features), dtype=self.dtype)
+        for row, record in zip(out, records):
+            self.transform_one(record, out=row)
+        return out
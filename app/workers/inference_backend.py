@@ -0,0 +1,154 @@
+import asyncio
+import multiprocessing
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Sequence, Union
+
+from app.helpers.asyncio_utils import run_in_executor
+from app.workers.model_scorer import ModelScorer, Prediction
+
+_worker_scorer: Optional[ModelScorer] = None
+
+
+def init_worker_scorer(model_path: str, version: str, loader_kwargs: dict, compiled_only: bool = False) -> None:
+    """
+    Инициализатор процесса пула: модель загружается один раз на процесс.
+    С compiled_only процесс открывает только CompiledForest из кэша, без копии модели sklearn в своей памяти
+    """
+    global _worker_scorer
+    if compiled_only:
+        _worker_scorer = ModelScorer.load_compiled(model_path, version=version, cache_dir=loader_kwargs["cache_dir"])
+    else:
+        _worker_scorer = ModelScorer.load(model_path, version=version, **loader_kwargs)
+
+
+def worker_predict_batch(records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+    return _worker_scorer.predict_batch(records)
+
+
+class InferenceBackend(ABC):
+    """
+    Среда выполнения скоринга пачки транзакций
+    """
+
+    workers: int = 1
+
+    @abstractmethod
+    async def predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        """
+        Скоринг пачки транзакций
+        :param records:     транзакции
+        :return:            вероятность с версией модели на каждую транзакцию или ошибка её препроцессинга
+        """
+        pass
+
+    @abstractmethod
+    async def swap(self, scorer: ModelScorer) -> None:
+        """
+        Переключение на новую версию модели, загруженную и прогретую в текущем процессе
+        :param scorer:      новая версия модели
+        """
+        pass
+
+    async def close(self) -> None:
+        return
+
+
+class InlineInferenceBackend(InferenceBackend):
+    """
+    Скоринг прямо в event loop
+    """
+
+    def __init__(self, scorer: ModelScorer):
+        self.scorer = scorer
+
+    async def predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        return self.scorer.predict_batch(records)
+
+    async def swap(self, scorer: ModelScorer) -> None:
+        self.scorer = scorer
+
+
+class ThreadInferenceBackend(InferenceBackend):
+    """
+    Скоринг в пуле потоков: numpy и деревья sklearn отпускают GIL на основной части работы
+    """
+
+    def __init__(self, scorer: ModelScorer, workers: int):
+        self.scorer = scorer
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    async def predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        return await run_in_executor(self.scorer.predict_batch, executor=self.executor, records=records)
+
+    async def swap(self, scorer: ModelScorer) -> None:
+        self.scorer = scorer
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ProcessInferenceBackend(InferenceBackend):
+    """
+    Скоринг в пуле процессов, каждый процесс загружает модель один раз при старте.
+    Если основной процесс включил CompiledForest и задан cache_dir, процессы пула читают только его
+    через mmap, и массивы деревьев хранятся в page cache один раз на все процессы.
+    При смене версии модели поднимается и прогревается новый пул, старый дорабатывает начатые пачки
+    """
+
+    def __init__(self, scorer: ModelScorer, workers: int, loader_kwargs: Optional[dict] = None):
+        """
+        :param scorer:          загруженная модель текущего процесса
+        :param workers:         количество процессов
+        :param loader_kwargs:   параметры ModelScorer.load
+        """
+        self.workers = workers
+        self.loader_kwargs = loader_kwargs or {}
+        self.executor = self._create_executor(scorer)
+
+    def _create_executor(self, scorer: ModelScorer) -> Executor:
+        compiled_only = scorer.compiled is not None and bool(self.loader_kwargs.get("cache_dir"))
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker_scorer,
+            initargs=(scorer.path, scorer.version, self.loader_kwargs, compiled_only),
+        )
+
+    async def predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        return await run_in_executor(worker_predict_batch, executor=self.executor, records=list(records))
+
+    async def swap(self, scorer: ModelScorer) -> None:
+        executor = self._create_executor(scorer)
+        try:
+            # Пустые пачки запускают все процессы нового пула и дожидаются загрузки в них модели
+            await asyncio.gather(
+                *[run_in_executor(worker_predict_batch, executor=executor, records=[]) for _ in range(self.workers)]
+            )
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor, self.executor = self.executor, executor
+        executor.shutdown(wait=False)
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_inference_backend(
+    backend_type: str, scorer: ModelScorer, workers: int, loader_kwargs: Optional[dict] = None
+) -> InferenceBackend:
+    """
+    :param backend_type:    inline, thread или process
+    :param scorer:          загруженная модель текущего процесса
+    :param workers:         количество потоков или процессов
+    :param loader_kwargs:   параметры ModelScorer.load для процессов пула
+    """
+    if backend_type == "inline":
+        return InlineInferenceBackend(scorer)
+    if backend_type == "thread":
+        return ThreadInferenceBackend(scorer, workers)
+    if backend_type == "process":
+        return ProcessInferenceBackend(scorer, workers, loader_kwargs)
+    raise ValueError(f"Неизвестный тип inference backend {backend_type!r}")
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional, Sequence, Union
+
+from prometheus_client import Histogram
+
+# Метрики на уровне модуля: повторная регистрация в реестре prometheus падает на втором экземпляре
+INFERENCE_BATCHER_QUEUE_WAIT_SECONDS = Histogram(
+    name="inference_batcher_queue_wait_seconds",
+    documentation="Гистограмма времени ожидания запроса в очереди батчера",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+INFERENCE_BATCHER_BATCH_SIZE = Histogram(
+    name="inference_batcher_batch_size",
+    documentation="Гистограмма размера пачек инференса",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+
+
+class InferenceBatcher:
+    """
+    Микробатчинг инференса: копит запросы до max_batch_size или max_wait секунд
+    и скорит их одним вызовом score_batch, раздавая каждому вызывающему его строку
+    """
+
+    def __init__(
+        self,
+        score_batch: Callable[[list], Awaitable[Sequence[Union[Any, Exception]]]],
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+        max_concurrency: int = 1,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param score_batch:         корутина скоринга пачки, возвращает результат или исключение на каждую запись
+        :param max_batch_size:      максимальный размер пачки
+        :param max_wait:            максимальное время ожидания набора пачки в секундах
+        :param max_concurrency:     количество одновременно скорящихся пачек
+        :param logger:              логгер
+        """
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self.logger = logger or logging
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches: set[asyncio.Task] = set()
+
+    async def submit(self, record: Any) -> Any:
+        """
+        Поставить запись в очередь на скоринг
+        :param record:      запись
+        :return:            результат скоринга записи
+        """
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future, monotonic()))
+        return await future
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._batches, return_exceptions=True)
+            self._task = None
+
+    async def _collect(self) -> list[tuple[Any, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        deadline = monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        while True:
+            await semaphore.acquire()
+            batch = await self._collect()
+            task = asyncio.create_task(self._score(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+            task.add_done_callback(lambda _task: semaphore.release())
+
+    async def _score(self, batch: list[tuple[Any, asyncio.Future, float]]) -> None:
+        started = monotonic()
+        for _record, _future, enqueued in batch:
+            INFERENCE_BATCHER_QUEUE_WAIT_SECONDS.observe(started - enqueued)
+        INFERENCE_BATCHER_BATCH_SIZE.observe(len(batch))
+        try:
+            results = await self.score_batch([record for record, _future, _enqueued in batch])
+        except Exception as error:  # noqa
+            self.logger.exception("Ошибка скоринга пачки из %s записей", len(batch))
+            results = [error] * len(batch)
+        for (_record, future, _enqueued), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
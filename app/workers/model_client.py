@@ -1,121 +1,178 @@
 import asyncio
-import ipaddress
-import json
-import logging
+from typing import Optional, Sequence, Union
 
-import joblib
-import pandas as pd
 from redis.asyncio.client import Redis
 
 from app.config import get_logger, settings
+from app.helpers.codecs import JsonCodec
+from app.helpers.interfaces import CodecAbc, FileHostingClientAbc
+from app.helpers.redis import RedisBulkPublisher, RedisRetryQueue
+from app.workers.inference_backend import create_inference_backend
+from app.workers.inference_batcher import InferenceBatcher
+from app.workers.model_registry import ModelRegistry
+from app.workers.model_scorer import Prediction
+from app.workers.prediction_cache import PredictionCache
 
 
 class ModelClient:
-    def __init__(self, redis: Redis):
+    def __init__(
+        self,
+        redis: Redis,
+        publisher: Optional[RedisBulkPublisher] = None,
+        retry_queue: Optional[RedisRetryQueue] = None,
+        codec: Optional[CodecAbc] = None,
+        prediction_cache: Optional[PredictionCache] = None,
+        model_path: str = "config/model.pkl",
+        models_dir: Optional[str] = None,
+        file_hosting_client: Optional[FileHostingClientAbc] = None,
+        bucket_name: Optional[str] = None,
+        poll_interval: float = 10,
+        cache_dir: Optional[str] = None,
+        compiled: bool = False,
+        sample_path: Optional[str] = None,
+        backend: str = "inline",
+        workers: int = 1,
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+    ):
         self.redis = redis
+        self.publisher = publisher
+        self.retry_queue = retry_queue
+        self.codec = codec or JsonCodec()
+        self.prediction_cache = prediction_cache
         self.logger = get_logger(__name__)
-        self.model = joblib.load("config/model.pkl")
+        loader_kwargs = {"cache_dir": cache_dir, "compiled": compiled, "sample_path": sample_path}
+        self.registry = ModelRegistry(
+            default_path=model_path,
+            models_dir=models_dir,
+            loader_kwargs=loader_kwargs,
+            file_hosting_client=file_hosting_client,
+            bucket_name=bucket_name,
+            poll_interval=poll_interval,
+            logger=self.logger,
+        )
+        self.backend = create_inference_backend(
+            backend, scorer=self.registry.active, workers=workers, loader_kwargs=loader_kwargs
+        )
+        self.registry.swap_callbacks.append(self.backend.swap)
+        if self.prediction_cache:
+            self.prediction_cache.activate(self.registry.active)
+            self.registry.swap_callbacks.append(self.prediction_cache.swap)
+        self.batcher = InferenceBatcher(
+            self.backend.predict_batch,
+            max_batch_size=max_batch_size,
+            max_wait=max_wait,
+            max_concurrency=self.backend.workers,
+            logger=self.logger,
+        )
         self.logger.info("Модель загружена успешно!")
 
-    async def router_inference(self, data) -> float:
-        df = pd.DataFrame([data])
-        df_preprocessed = self._preprocessing(df)
-        return self._processing(df_preprocessed)
+    async def start(self) -> None:
+        await self.registry.start()
+
+    async def router_inference(self, data) -> Prediction:
+        return await self._predict(data)
+
+    async def router_batch_inference(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        return await self._predict_batch(records)
 
     async def inference(self, data):
         try:
-            df = pd.DataFrame([data])
-
-            df_preprocessed = self._preprocessing(df)
-            result = self._processing(df_preprocessed)
-            data = self._postprocessing(data, result)
-            await self._send_to_queue(data)
-            await asyncio.sleep(10)
+            prediction = await self._predict(data)
+            sent = await self._send_to_queue(self._postprocessing(data, prediction))
+            if sent:
+                await sent
         except Exception as e:
             self.logger.exception(f"Ошибка работы инференса --- {e}")
+            await self._retry(data, e)
         else:
             self.logger.info(f"Инференс отработал успешно! --- {data['id']}")
 
-    def _preprocessing(self, df: pd.DataFrame) -> pd.DataFrame:
-        columns = [
-            "ip",
-            "device_id",
-            "tran_code",
-            "mcc",
-            "client_id",
-            "pin_inc_count",
-            "expiration_date",
-            "datetime",
-            "sum",
-            "balance",
-            "device_type_ATM",
-            "device_type_Portable term",
-            "device_type_atm",
-            "device_type_cash_in",
-            "device_type_cash_out",
-            "device_type_port_trm",
-            "device_type_pos trm",
-            "device_type_prtbl trm",
-            "oper_type_add_on_acc",
-            "oper_type_bad",
-            "oper_type_blk",
-            "oper_type_blocked",
-            "oper_type_country_transfer",
-            "oper_type_decrease_on_acc",
-            "oper_type_diff_cntry",
-            "oper_type_err",
-            "oper_type_err_code",
-            "oper_type_from_acc",
-            "oper_type_in",
-            "oper_type_in_acc",
-            "oper_type_out",
-            "oper_type_payment",
-            "oper_type_transfer",
-            "card_status_act",
-            "card_status_active",
-            "card_status_blk",
-            "card_status_blocked",
-            "card_type_CREDIT",
-            "card_type_DEBIT",
-        ]
-        df_combined = df.drop(columns=["transaction_id"])
-        df_combined = df_combined.drop(columns=["id"])
-        df_combined = pd.get_dummies(df_combined, columns=["device_type"])
-        df_combined[df_combined.columns[df_combined.columns.str.startswith("device_type")]] = df_combined[
-            df_combined.columns[df_combined.columns.str.startswith("device_type")]
-        ].astype(int)
-        df_combined = pd.get_dummies(df_combined, columns=["oper_type"])
-        df_combined[df_combined.columns[df_combined.columns.str.startswith("oper_type")]] = df_combined[
-            df_combined.columns[df_combined.columns.str.startswith("oper_type")]
-        ].astype(int)
-        df_combined = pd.get_dummies(df_combined, columns=["card_status"])
-        df_combined[df_combined.columns[df_combined.columns.str.startswith("card_status")]] = df_combined[
-            df_combined.columns[df_combined.columns.str.startswith("card_status")]
-        ].astype(int)
-        df_combined = pd.get_dummies(df_combined, columns=["card_type"])
-        df_combined[df_combined.columns[df_combined.columns.str.startswith("card_type")]] = df_combined[
-            df_combined.columns[df_combined.columns.str.startswith("card_type")]
-        ].astype(int)
-        df_combined["ip"] = df_combined["ip"].apply(lambda x: int(ipaddress.IPv4Address(x)))
-        df_combined["datetime"] = pd.to_datetime(df_combined["datetime"])
-        df_combined["datetime"] = df_combined["datetime"].apply(lambda x: x.timestamp())
-        df_combined["expiration_date"] = pd.to_datetime(df_combined["expiration_date"])
-        df_combined["expiration_date"] = df_combined["expiration_date"].apply(lambda x: x.timestamp())
-        for col in columns:
-            if col not in df_combined.columns:
-                df_combined[col] = 0
-        df_combined = df_combined[columns]
-        return df_combined
-
-    def _processing(self, df: pd.DataFrame) -> float:
-        predictions = self.model.predict_proba(df)
-        return float(predictions[:, 1][0])
-
-    def _postprocessing(self, data: dict, result: float) -> dict:
-        data["pred"] = result
-        return data
-
-    async def _send_to_queue(self, data: dict):
-        data_json = json.dumps(data)
-
-        await self.redis.rpush(settings.AMQP.routing_keys.backend_routing_key, data_json)
+    async def batch_inference(self, records: Sequence[dict]) -> None:
+        """
+        Инференс пачки транзакций из очереди одним вызовом скоринга
+        :param records:     транзакции
+        """
+        try:
+            predictions = await self._predict_batch(records)
+        except Exception as e:
+            self.logger.exception(f"Ошибка работы инференса пачки из {len(records)} записей --- {e}")
+            predictions = [e] * len(records)
+        sent = []
+        for data, prediction in zip(records, predictions):
+            try:
+                if isinstance(prediction, Exception):
+                    raise prediction
+                sent.append((data, await self._send_to_queue(self._postprocessing(data, prediction))))
+            except Exception as e:
+                self.logger.exception(f"Ошибка работы инференса --- {e}")
+                await self._retry(data, e)
+        if self.publisher:
+            # Пачка подтверждается в очереди только после того, как её результаты ушли в redis
+            await self.publisher.flush()
+        for data, future in sent:
+            try:
+                if future:
+                    await future
+            except Exception as e:
+                # Неотправленный результат удалён из буфера publisher, запись уходит на повтор один раз
+                self.logger.exception(f"Ошибка отправки результата инференса --- {e}")
+                await self._retry(data, e)
+            else:
+                self.logger.info(f"Инференс отработал успешно! --- {data['id']}")
+
+    def predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        """
+        Скоринг пачки транзакций активной версией модели в текущем потоке
+        :param records:     транзакции
+        :return:            вероятность с версией модели на каждую транзакцию или ошибка её препроцессинга
+        """
+        return self.registry.active.predict_batch(records)
+
+    async def close(self) -> None:
+        await self.registry.close()
+        await self.batcher.close()
+        await self.backend.close()
+
+    async def _predict(self, data: dict) -> Prediction:
+        if not self.prediction_cache:
+            return await self.batcher.submit(data)
+        [prediction] = await self.prediction_cache.get_many([data])
+        if prediction is None:
+            prediction = await self.batcher.submit(data)
+            await self.prediction_cache.set_many([data], [prediction])
+        return prediction
+
+    async def _predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        # Повторно доставленные транзакции берутся из кеша, модель скорит только остальные
+        if not self.prediction_cache:
+            return await self.backend.predict_batch(records)
+        predictions = await self.prediction_cache.get_many(records)
+        missing = [index for index, prediction in enumerate(predictions) if prediction is None]
+        if missing:
+            missing_records = [records[index] for index in missing]
+            scored = await self.backend.predict_batch(missing_records)
+            for index, prediction in zip(missing, scored):
+                predictions[index] = prediction
+            await self.prediction_cache.set_many(missing_records, scored)
+        return predictions
+
+    def _postprocessing(self, data: dict, prediction: Prediction) -> dict:
+        # Исходная запись не меняется, при ошибке отправки она уходит на повтор в исходном виде
+        return {**data, "pred": prediction.pred, "model_version": prediction.model_version}
+
+    async def _retry(self, data: dict, error: Exception) -> None:
+        if not self.retry_queue:
+            return
+        try:
+            await self.retry_queue.fail(settings.AMQP.routing_keys.model_manager_routing_key, data, error)
+        except Exception as e:
+            self.logger.exception(f"Ошибка отправки записи на повтор --- {e}")
+
+    async def _send_to_queue(self, data: dict) -> Optional[asyncio.Future]:
+        message = self.codec.dumps(data)
+
+        if self.publisher:
+            return await self.publisher.publish(settings.AMQP.routing_keys.backend_routing_key, message)
+        await self.redis.rpush(settings.AMQP.routing_keys.backend_routing_key, message)
+        return None
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from app.helpers.asyncio_utils import scheduled_task
+from app.helpers.interfaces import FileHostingClientAbc
+from app.workers.model_scorer import ModelScorer, load_sample
+from app.workers.model_store import ModelStore
+
+
+class ModelRegistry:
+    """
+    Реестр версий модели. Версия - файл *.pkl в models_dir, активной считается самая свежая по mtime.
+    Если задан bucket_name, новые версии сначала скачиваются из файлового хранилища в models_dir.
+    Новая версия загружается и прогревается на записанных транзакциях в фоне, затем ссылка на
+    активную модель подменяется целиком, без остановки скоринга
+    """
+
+    def __init__(
+        self,
+        default_path: str,
+        models_dir: Optional[str] = None,
+        loader_kwargs: Optional[dict] = None,
+        file_hosting_client: Optional[FileHostingClientAbc] = None,
+        bucket_name: Optional[str] = None,
+        poll_interval: float = 10,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param default_path:            модель, используемая пока в models_dir нет версий
+        :param models_dir:              директория версий модели
+        :param loader_kwargs:           параметры ModelScorer.load
+        :param file_hosting_client:     клиент файлового хранилища с версиями модели
+        :param bucket_name:             bucket с версиями модели
+        :param poll_interval:           периодичность проверки новых версий в секундах
+        :param logger:                  логгер
+        """
+        self.default_path = default_path
+        self.models_dir = Path(models_dir) if models_dir else None
+        self.loader_kwargs = loader_kwargs or {}
+        self.file_hosting_client = file_hosting_client
+        self.bucket_name = bucket_name
+        self.poll_interval = poll_interval
+        self.logger = logger or logging
+        self.swap_callbacks: list[Callable[[ModelScorer], Awaitable[None]]] = []
+        self._task: Optional[asyncio.Task] = None
+
+        path = self._latest_path()
+        self._loaded = (path, ModelStore.fingerprint(path))
+        self.active: ModelScorer = self._load(path)
+
+    async def start(self) -> None:
+        self._task = scheduled_task(self.refresh, repeat_timeout=self.poll_interval, logger=self.logger)
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def refresh(self) -> None:
+        """
+        Проверка новой версии, её загрузка, прогрев и переключение на неё
+        """
+        if self.file_hosting_client and self.bucket_name:
+            await self._sync_bucket()
+        path = self._latest_path()
+        loaded = (path, ModelStore.fingerprint(path))
+        if loaded == self._loaded:
+            return
+        # Битая версия не перечитывается на каждой проверке, только после изменения файла
+        self._loaded = loaded
+        self.logger.info("Найдена новая версия модели %s", path)
+        try:
+            scorer = await asyncio.to_thread(self._load, path)
+        except Exception:  # noqa
+            self.logger.exception("Ошибка загрузки версии модели %s, остаётся версия %s", path, self.active.version)
+            return
+        # Активная версия меняется до обработчиков: пока они работают, новые запросы уже видят новую версию
+        self.active = scorer
+        self.logger.info("Активная версия модели: %s", scorer.version)
+        for callback in self.swap_callbacks:
+            try:
+                await callback(scorer)
+            except Exception:  # noqa
+                self.logger.exception("Ошибка обработчика смены версии модели %s", scorer.version)
+
+    def _latest_path(self) -> str:
+        if self.models_dir and self.models_dir.is_dir():
+            versions = sorted(self.models_dir.glob("*.pkl"), key=lambda path: (path.stat().st_mtime_ns, path.name))
+            if versions:
+                return str(versions[-1])
+        return self.default_path
+
+    def _load(self, path: str) -> ModelScorer:
+        scorer = ModelScorer.load(path, logger=self.logger, **self.loader_kwargs)
+        sample = load_sample(self.loader_kwargs.get("sample_path"))
+        results = scorer.predict_batch(sample)
+        if sample and all(isinstance(result, Exception) for result in results):
+            raise ValueError(f"Прогрев версии {scorer.version} не удался: {results[0]}")
+        self.logger.info("Версия модели %s загружена и прогрета на %s записях", scorer.version, len(sample))
+        return scorer
+
+    async def _sync_bucket(self) -> None:
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+        for item in await self.file_hosting_client.get_list_objects(self.bucket_name):
+            object_name = item.object_name
+            path = self.models_dir / Path(object_name).name
+            if not object_name.endswith(".pkl") or path.exists():
+                continue
+            self.logger.info("Загрузка версии модели %s из bucket %s", object_name, self.bucket_name)
+            # Файл появляется в models_dir только целиком, чтобы его не подхватила незавершённая загрузка
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as file:
+                async for chunk in self.file_hosting_client.download_file_chunk(self.bucket_name, object_name):
+                    file.write(chunk)
+            os.replace(tmp_path, path)
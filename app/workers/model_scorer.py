@@ -0,0 +1,159 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any, NamedTuple, Optional, Sequence, Union
+
+import joblib
+import numpy as np
+
+from app.workers.compiled_forest import CompiledForest
+from app.workers.feature_encoder import FEATURE_COLUMNS, FeatureEncoder, model_input
+from app.workers.model_store import ModelStore
+
+
+class Prediction(NamedTuple):
+    pred: float
+    model_version: str
+
+
+def load_sample(path: Optional[str]) -> list[dict]:
+    """
+    Загрузка записанных транзакций для проверки и прогрева модели
+    :param path:    путь до JSON-массива транзакций
+    """
+    if not path:
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.loads(file.read())
+    except FileNotFoundError:
+        return []
+
+
+class ModelScorer:
+    """
+    Модель вместе со скомпилированным препроцессингом её признаков.
+    Моделью может быть и сам CompiledForest: он хранит имена признаков и обрабатывает пропуски
+    """
+
+    def __init__(self, model: Any, version: str = "", path: str = "", logger: logging.Logger = None):
+        """
+        :param model:       модель
+        :param version:     версия модели, проставляется в каждый результат скоринга
+        :param path:        путь, с которого загружена модель
+        :param logger:      логгер
+        """
+        self.model = model
+        self.version = version
+        self.path = path
+        self.logger = logger or logging
+        columns = getattr(model, "feature_names_in_", None)
+        self.encoder = FeatureEncoder(columns=FEATURE_COLUMNS if columns is None else columns)
+        self.compiled: Optional[CompiledForest] = model if isinstance(model, CompiledForest) else None
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        version: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        compiled: bool = False,
+        sample_path: Optional[str] = None,
+        logger: logging.Logger = None,
+    ) -> "ModelScorer":
+        """
+        :param path:            путь до модели
+        :param version:         версия модели, по умолчанию имя файла без расширения и хэш его содержимого
+        :param cache_dir:       директория кэша ModelStore, без неё модель загружается напрямую
+        :param compiled:        скорить через CompiledForest, если он эквивалентен модели
+        :param sample_path:     записанные транзакции для проверки эквивалентности CompiledForest
+        :param logger:          логгер
+        """
+        store = ModelStore(cache_dir, logger) if cache_dir else None
+        model = store.load(path) if store else joblib.load(path)
+        # Хэш в версии отличает модели, заменённые под тем же именем файла, в том числе в кеше результатов
+        version = version or f"{Path(path).stem}@{ModelStore.digest(path)}"
+        scorer = cls(model, version=version, path=path, logger=logger)
+        if compiled:
+            scorer.compile(store, path, load_sample(sample_path))
+        return scorer
+
+    @classmethod
+    def load_compiled(
+        cls,
+        path: str,
+        version: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        logger: logging.Logger = None,
+    ) -> "ModelScorer":
+        """
+        Загрузка только CompiledForest из кэша ModelStore, без распаковки модели sklearn.
+        Массивы CompiledForest читаются через mmap и общие для всех процессов, собственная память процесса
+        не растёт с размером модели. Эквивалентность с моделью проверяет процесс, загрузивший её через load
+        :param path:            путь до модели
+        :param version:         версия модели
+        :param cache_dir:       директория кэша ModelStore
+        :param logger:          логгер
+        """
+        if not cache_dir:
+            raise ValueError("Для загрузки CompiledForest без модели нужен cache_dir")
+        compiled = ModelStore(cache_dir, logger).load(
+            path, kind=CompiledForest.cache_kind, build=CompiledForest.from_path
+        )
+        version = version or f"{Path(path).stem}@{ModelStore.digest(path)}"
+        return cls(compiled, version=version, path=path, logger=logger)
+
+    def compile(self, store: Optional[ModelStore], path: str, sample: Sequence[dict]) -> bool:
+        """
+        Включение CompiledForest после проверки побитового совпадения с predict_proba модели
+        на записанных транзакциях и синтетических входах по порогам деревьев
+        """
+        try:
+            if store:
+                compiled = store.load(
+                    path, kind=CompiledForest.cache_kind, build=lambda _path: CompiledForest.from_model(self.model)
+                )
+            else:
+                compiled = CompiledForest.from_model(self.model)
+        except TypeError as error:
+            self.logger.warning("CompiledForest отключён: %s", error)
+            return False
+        features, _valid, _results = self._preprocessing(sample)
+        features = np.vstack([features, compiled.verification_features(self.encoder.n_features)])
+        if not compiled.is_equivalent(self.model, features):
+            self.logger.error("CompiledForest отключён: результат не совпадает с predict_proba модели")
+            return False
+        self.compiled = compiled
+        self.logger.info("CompiledForest включён, проверено записей: %s", len(features))
+        return True
+
+    def predict_batch(self, records: Sequence[dict]) -> list[Union[Prediction, Exception]]:
+        """
+        Скоринг пачки транзакций одним вызовом модели
+        :param records:     транзакции
+        :return:            вероятность с версией модели на каждую транзакцию или ошибка её препроцессинга
+        """
+        features, valid, results = self._preprocessing(records)
+        if valid:
+            for index, prediction in zip(valid, self._processing(features)):
+                results[index] = Prediction(float(prediction), self.version)
+        return results
+
+    def _preprocessing(self, records: Sequence[dict]) -> tuple[np.ndarray, list[int], list]:
+        features = np.empty((len(records), self.encoder.n_features), dtype=self.encoder.dtype)
+        valid: list[int] = []
+        results: list = [None] * len(records)
+        for index, record in enumerate(records):
+            try:
+                self.encoder.transform_one(record, out=features[len(valid)])
+            except Exception as error:  # noqa
+                results[index] = error
+            else:
+                valid.append(index)
+        return features[: len(valid)], valid, results
+
+    def _processing(self, features: np.ndarray) -> np.ndarray:
+        if self.compiled:
+            return self.compiled.predict_proba(features)[:, 1]
+        predictions = self.model.predict_proba(model_input(self.model, features))
+        return predictions[:, 1]
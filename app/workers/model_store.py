@@ -0,0 +1,89 @@
+import fcntl
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable
+
+import joblib
+
+
+class ModelStore:
+    """
+    Кэш моделей для загрузки с mmap_mode="r".
+    При первой загрузке модель (или производный от неё объект, например CompiledForest) пересохраняется
+    без сжатия в cache_dir, дальше все процессы открывают этот файл через mmap и делят numpy-массивы
+    через page cache ОС.
+    Кэш привязан к пути, размеру и mtime исходного файла, при замене модели пересоздаётся автоматически.
+    Общими между процессами остаются только массивы, которые numpy читает напрямую из файла, например
+    массивы CompiledForest. Узлы деревьев sklearn (Tree) при распаковке копируются в собственную память объекта,
+    поэтому для исходной модели mmap ускоряет только холодный старт, но не уменьшает RSS процесса.
+    Процессы пула инференса поэтому загружают только CompiledForest (ModelScorer.load_compiled)
+    """
+
+    def __init__(self, cache_dir: str, logger: logging.Logger = None):
+        """
+        :param cache_dir:   директория кэша
+        :param logger:      логгер
+        """
+        self.cache_dir = Path(cache_dir)
+        self.logger = logger or logging
+
+    @staticmethod
+    def fingerprint(path: str) -> str:
+        stat = os.stat(path)
+        return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+    @staticmethod
+    def digest(path: str) -> str:
+        """
+        Хэш содержимого файла модели: в отличие от fingerprint, совпадает на всех хостах и не меняется
+        при копировании файла
+        :param path:    путь до файла модели
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def cache_name(path: str) -> str:
+        # Хэш полного пути: одноимённые модели из разных директорий не делят кэш и блокировку
+        digest = hashlib.blake2b(str(Path(path).resolve()).encode("utf-8"), digest_size=8).hexdigest()
+        return f"{Path(path).stem}-{digest}"
+
+    def cache_path(self, path: str, kind: str = "model") -> Path:
+        return self.cache_dir / f"{self.cache_name(path)}@{self.fingerprint(path)}.{kind}.joblib"
+
+    def load(self, path: str, kind: str = "model", build: Callable[[str], Any] = joblib.load) -> Any:
+        """
+        Загрузка модели через кэш
+        :param path:    путь до исходного файла модели
+        :param kind:    вид кэшируемого объекта
+        :param build:   построение объекта по пути до модели при промахе кэша
+        :return:        объект из кэша
+        """
+        cache_path = self.cache_path(path, kind)
+        if not cache_path.exists():
+            self._build(path, cache_path, build)
+        return joblib.load(cache_path, mmap_mode="r")
+
+    def _build(self, path: str, cache_path: Path, build: Callable[[str], Any]) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        name = self.cache_name(path)
+        with open(self.cache_dir / f"{name}.lock", "w") as lock:
+            # Кэш строит только первый из одновременно стартующих воркеров, остальные ждут его на блокировке
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if cache_path.exists():
+                    return
+                self.logger.info("Построение кэша модели %s -> %s", path, cache_path)
+                tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+                joblib.dump(build(path), tmp_path)
+                os.replace(tmp_path, cache_path)
+                for stale_path in self.cache_dir.glob(f"{name}@*.joblib"):
+                    if not stale_path.name.startswith(f"{name}@{self.fingerprint(path)}."):
+                        stale_path.unlink(missing_ok=True)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
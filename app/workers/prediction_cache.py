@@ -0,0 +1,132 @@
+import hashlib
+import logging
+from typing import Optional, Sequence, Union
+
+from prometheus_client import Counter
+from redis.asyncio import Redis
+
+from app.helpers.codecs import JsonCodec
+from app.helpers.redis import RedisCache
+from app.workers.feature_encoder import FeatureEncoder
+from app.workers.model_scorer import ModelScorer, Prediction
+
+# Попадания и промахи считает redis_cache_requests_total{cache="prediction"}
+PREDICTION_CACHE_MISMATCH_TOTAL = Counter(
+    name="prediction_cache_mismatch_total",
+    documentation="Счётчик транзакций, найденных в кеше результатов с другим содержимым",
+)
+
+
+class PredictionCache:
+    """
+    Кеш результатов скоринга для повторных доставок и повторов одной транзакции.
+    Ключ - версия модели и transaction_id, вместе с результатом хранится хэш признаков записи после FeatureEncoder
+    активной модели: транзакция с тем же id, но другими признаками скорится заново, а служебные поля и формат
+    дат (HTTP или очередь) на хэш не влияют. Память процесса и redis - через RedisCache.
+    Версия модели включает хэш файла, поэтому смена активной модели, в том числе замена файла под тем же
+    именем, сбрасывает память процесса, а записи старой версии в redis перестают читаться и истекают по ttl
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        ttl: int = 600,
+        local_maxsize: int = 10000,
+        key_field: str = "transaction_id",
+        prefix: str = "prediction_cache",
+        timeout: float = 0.07,
+        logger: logging.Logger = None,
+    ):
+        """
+        :param redis:           клиент redis
+        :param ttl:             время хранения результата в секундах
+        :param local_maxsize:   количество результатов в памяти процесса, 0 - только redis
+        :param key_field:       поле записи с идентификатором транзакции
+        :param prefix:          префикс ключей redis
+        :param timeout:         время ожидания ответа redis в секундах, при превышении запись скорится заново
+        :param logger:          логгер
+        """
+        self.ttl = ttl
+        self.key_field = key_field
+        self.prefix = prefix
+        self.timeout = timeout
+        self.logger = logger or logging
+        self.version: Optional[str] = None
+        self.encoder = FeatureEncoder()
+        self.cache = RedisCache(
+            redis, logger=self.logger, serializer=JsonCodec(), name="prediction", local_maxsize=local_maxsize
+        )
+
+    def digest(self, record: dict) -> Optional[str]:
+        """
+        Хэш признаков записи, None - запись не проходит препроцессинг и не кешируется
+        :param record:      транзакция
+        """
+        try:
+            features = self.encoder.transform_one(record)
+        except Exception:  # noqa
+            return None
+        return hashlib.blake2b(features.tobytes(), digest_size=16).hexdigest()
+
+    def key(self, record: dict, version: str) -> Optional[str]:
+        transaction_id = record.get(self.key_field)
+        if transaction_id is None:
+            return None
+        return f"{self.prefix}:{version}:{transaction_id}"
+
+    async def get_many(self, records: Sequence[dict]) -> list[Optional[Prediction]]:
+        """
+        Результаты скоринга транзакций активной версией модели
+        :param records:     транзакции
+        :return:            результат или None на каждую транзакцию
+        """
+        digests = [self.digest(record) for record in records]
+        keys = [self.key(record, self.version) if digest else None for record, digest in zip(records, digests)]
+        lookup = [key for key in keys if key is not None]
+        values = iter(await self.cache.get_many(lookup, timeout=self.timeout) if lookup else [])
+        results = []
+        for record, key, digest in zip(records, keys, digests):
+            value = next(values) if key is not None else None
+            if not value:
+                results.append(None)
+            elif value["digest"] != digest:
+                PREDICTION_CACHE_MISMATCH_TOTAL.inc()
+                self.logger.warning("Транзакция %s уже скорилась с другим содержимым", record.get(self.key_field))
+                results.append(None)
+            else:
+                results.append(Prediction(value["pred"], value["model_version"]))
+        return results
+
+    async def set_many(self, records: Sequence[dict], predictions: Sequence[Union[Prediction, Exception]]) -> None:
+        """
+        Сохранить результаты скоринга, ошибки не сохраняются
+        :param records:         транзакции
+        :param predictions:     результат или ошибка на каждую транзакцию
+        """
+        items = {}
+        for record, prediction in zip(records, predictions):
+            if isinstance(prediction, Exception):
+                continue
+            # Ключ по версии из результата: скоринг мог закончиться уже после смены модели
+            key = self.key(record, prediction.model_version)
+            digest = self.digest(record) if key is not None else None
+            if digest is not None:
+                items[key] = {
+                    "digest": digest,
+                    "pred": prediction.pred,
+                    "model_version": prediction.model_version,
+                }
+        await self.cache.set_many(items, timeout=self.timeout, expire=self.ttl)
+
+    def activate(self, scorer: ModelScorer) -> None:
+        """
+        Читать и хэшировать записи для активной версии модели
+        :param scorer:      активная версия модели
+        """
+        self.version = scorer.version
+        self.encoder = scorer.encoder
+
+    async def swap(self, scorer: ModelScorer) -> None:
+        self.activate(scorer)
+        if self.cache.local is not None:
+            self.cache.local.clear()
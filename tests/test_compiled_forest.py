@@ -0,0 +1,85 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+from app.workers.compiled_forest import CompiledForest
+from app.workers.feature_encoder import model_input
+from app.workers.model_scorer import ModelScorer, load_sample
+
+MODEL_PATH = "config/model.pkl"
+SAMPLE_PATH = "config/model_sample.json"
+
+pytestmark = pytest.mark.skipif(not os.path.exists(MODEL_PATH), reason="Нет файла модели config/model.pkl")
+
+
+@pytest.fixture(scope="module")
+def scorer() -> ModelScorer:
+    return ModelScorer(joblib.load(MODEL_PATH), version="test")
+
+
+@pytest.fixture(scope="module")
+def compiled(scorer: ModelScorer) -> CompiledForest:
+    return CompiledForest.from_model(scorer.model)
+
+
+@pytest.fixture(scope="module")
+def sample_features(scorer: ModelScorer) -> np.ndarray:
+    features, valid, _results = scorer._preprocessing(load_sample(SAMPLE_PATH))
+    assert valid, "В записанных транзакциях нет ни одной валидной записи"
+    return features
+
+
+def model_proba(scorer: ModelScorer, features: np.ndarray) -> np.ndarray:
+    return scorer.model.predict_proba(model_input(scorer.model, features))
+
+
+def test_sample_matches_predict_proba(scorer, compiled, sample_features):
+    assert np.array_equal(compiled.predict_proba(sample_features), model_proba(scorer, sample_features))
+
+
+def test_verification_features_match_predict_proba(scorer, compiled):
+    features = compiled.verification_features(scorer.encoder.n_features)
+    assert compiled.is_equivalent(scorer.model, features)
+
+
+def test_threshold_equal_rows_match_predict_proba(scorer, compiled, sample_features):
+    # Значение признака ровно на пороге узла уходит влево (x <= threshold), как и в sklearn
+    is_split = np.isfinite(compiled.threshold)
+    thresholds, columns = compiled.threshold[is_split], compiled.feature[is_split]
+    rows = np.repeat(sample_features[:1], len(thresholds), axis=0).astype(np.float64)
+    rows[np.arange(len(thresholds)), columns] = thresholds
+    assert np.array_equal(compiled.predict_proba(rows), model_proba(scorer, rows))
+
+
+def test_nan_rows_match_predict_proba(scorer, compiled, sample_features):
+    # Пропуски обходятся по missing_go_to_left узлов, как в деревьях sklearn
+    assert compiled.allow_missing
+    features = sample_features.copy()
+    features[::2, 0] = np.nan
+    features[1::3, -1] = np.nan
+    assert np.array_equal(compiled.predict_proba(features), model_proba(scorer, features))
+
+
+def test_verification_features_cover_missing_values(compiled, scorer):
+    features = compiled.verification_features(scorer.encoder.n_features)
+    assert np.isnan(features).any()
+    assert compiled.is_equivalent(scorer.model, features)
+
+
+def test_compiled_only_scorer_matches_model(tmp_path, scorer):
+    # Процессы пула скорят из кэша CompiledForest без загрузки модели sklearn
+    records = load_sample(SAMPLE_PATH)
+    compiled_scorer = ModelScorer.load_compiled(MODEL_PATH, version="test", cache_dir=str(tmp_path))
+    assert compiled_scorer.model is compiled_scorer.compiled
+    assert compiled_scorer.encoder.columns == scorer.encoder.columns
+    features, valid, _results = scorer._preprocessing(records)
+    expected = model_proba(scorer, features)[:, 1]
+    predictions = compiled_scorer.predict_batch(records)
+    assert [predictions[index].pred for index in valid] == expected.tolist()
+
+
+def test_unsupported_model_raises():
+    with pytest.raises(TypeError):
+        CompiledForest.from_model(object())
@@ -0,0 +1,68 @@
+import ipaddress
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.workers.feature_encoder import FEATURE_COLUMNS, FeatureEncoder
+
+SAMPLE_PATH = "config/model_sample.json"
+
+
+def reference_preprocessing(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Препроцессинг на pandas, который заменил FeatureEncoder: результат обязан совпадать побитово
+    """
+    df_combined = df.drop(columns=["transaction_id"])
+    df_combined = df_combined.drop(columns=["id"])
+    for feature in ("device_type", "oper_type", "card_status", "card_type"):
+        df_combined = pd.get_dummies(df_combined, columns=[feature])
+        dummies = df_combined.columns[df_combined.columns.str.startswith(feature)]
+        df_combined[dummies] = df_combined[dummies].astype(int)
+    df_combined["ip"] = df_combined["ip"].apply(lambda x: int(ipaddress.IPv4Address(x)))
+    df_combined["datetime"] = pd.to_datetime(df_combined["datetime"])
+    df_combined["datetime"] = df_combined["datetime"].apply(lambda x: x.timestamp())
+    df_combined["expiration_date"] = pd.to_datetime(df_combined["expiration_date"])
+    df_combined["expiration_date"] = df_combined["expiration_date"].apply(lambda x: x.timestamp())
+    for col in FEATURE_COLUMNS:
+        if col not in df_combined.columns:
+            df_combined[col] = 0
+    return df_combined[list(FEATURE_COLUMNS)]
+
+
+def load_records() -> list[dict]:
+    with open(SAMPLE_PATH, "r", encoding="utf-8") as file:
+        return json.loads(file.read())
+
+
+def edge_records() -> list[dict]:
+    record = load_records()[0]
+    return [
+        {**record, "device_type": "kiosk", "oper_type": "unknown", "card_status": "frozen"},
+        {**record, "device_id": None},
+        {**record, "card_type": None},
+        {**record, "datetime": "2024-06-28T01:58:32+03:00"},
+        {**record, "datetime": "2024-06-28T01:58:32Z", "expiration_date": "2025-07-01T00:00:00+05:00"},
+        {**record, "sum": "53682.4"},
+        {**record, "tran_code": 0, "balance": -1.5, "pin_inc_count": 3},
+    ]
+
+
+@pytest.mark.parametrize("record", load_records() + edge_records())
+def test_transform_one_matches_reference(record):
+    expected = reference_preprocessing(pd.DataFrame([record])).to_numpy(dtype=np.float64)[0]
+    assert np.array_equal(FeatureEncoder().transform_one(record), expected, equal_nan=True)
+
+
+def test_transform_matches_reference_on_batch():
+    records = load_records() + edge_records()
+    expected = np.vstack(
+        [reference_preprocessing(pd.DataFrame([record])).to_numpy(dtype=np.float64) for record in records]
+    )
+    assert np.array_equal(FeatureEncoder().transform(records), expected, equal_nan=True)
+
+
+def test_unknown_model_column_raises():
+    with pytest.raises(ValueError):
+        FeatureEncoder(columns=("ip", "unknown_feature"))
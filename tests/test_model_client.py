@@ -0,0 +1,83 @@
+import os
+import shutil
+from collections import Counter
+
+import pytest
+
+from app.config import settings
+from app.helpers.redis import RedisBulkPublisher
+from app.workers.model_client import ModelClient
+from app.workers.model_scorer import Prediction, load_sample
+
+fakeredis = pytest.importorskip("fakeredis")
+
+MODEL_PATH = "config/model.pkl"
+SAMPLE_PATH = "config/model_sample.json"
+
+pytestmark = pytest.mark.skipif(not os.path.exists(MODEL_PATH), reason="Нет файла модели config/model.pkl")
+
+
+class FakeRetryQueue:
+    def __init__(self):
+        self.failed: list[dict] = []
+
+    async def fail(self, routing_key: str, message: dict, error: BaseException) -> None:
+        self.failed.append(message)
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis()
+
+
+@pytest.fixture
+def client(tmp_path, redis) -> ModelClient:
+    model_path = tmp_path / "model.pkl"
+    shutil.copyfile(MODEL_PATH, model_path)
+    publisher = RedisBulkPublisher(redis, max_batch_size=4, max_wait=60)
+    return ModelClient(redis, publisher=publisher, retry_queue=FakeRetryQueue(), model_path=str(model_path))
+
+
+def fail_pipeline(monkeypatch, redis, failing_call: int) -> None:
+    pipeline, calls = redis.pipeline, []
+
+    def failing_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        calls.append(pipe)
+        if len(calls) == failing_call:
+
+            async def execute(*_args, **_kwargs):
+                raise ConnectionError("redis недоступен")
+
+            pipe.execute = execute
+        return pipe
+
+    monkeypatch.setattr(redis, "pipeline", failing_pipeline)
+
+
+async def output_ids(client: ModelClient, redis) -> Counter:
+    messages = await redis.lrange(settings.AMQP.routing_keys.backend_routing_key, 0, -1)
+    return Counter(client.codec.loads(message)["id"] for message in messages)
+
+
+# 14 записей при max_batch_size=4: три сброса по заполнению буфера внутри пачки и финальный flush из двух записей
+@pytest.mark.parametrize("failing_call", [1, 3, 4])
+async def test_failed_flush_outputs_each_record_once(monkeypatch, client, redis, failing_call):
+    records = [
+        record
+        for record, prediction in zip(load_sample(SAMPLE_PATH), client.predict_batch(load_sample(SAMPLE_PATH)))
+        if isinstance(prediction, Prediction)
+    ][:14]
+    assert len(records) == 14
+    fail_pipeline(monkeypatch, redis, failing_call)
+
+    await client.batch_inference(records)
+    retried = client.retry_queue.failed
+    # Записи упавшего сброса уходят на повтор, в буфере publisher ничего не остаётся
+    assert len(retried) == (2 if failing_call == 4 else 4)
+    assert client.publisher._size == 0
+
+    client.retry_queue.failed = []
+    await client.batch_inference(retried)
+    assert client.retry_queue.failed == []
+    assert await output_ids(client, redis) == Counter(record["id"] for record in records)
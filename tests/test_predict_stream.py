@@ -0,0 +1,60 @@
+import json
+
+import httpx
+from fastapi import FastAPI
+
+from app.api.routers.predict_router import ndjson_chunks, router
+from app.container import Container
+
+
+class FakeModel:
+    async def router_batch_inference(self, records: list[dict]) -> list[tuple[float, str]]:
+        return [(record["sum"], "test") for record in records]
+
+
+def make_record(index: int) -> dict:
+    return {
+        "record_id": index,
+        "transaction_id": index,
+        "ip": "10.0.0.1",
+        "device_id": 1.0,
+        "device_type": "mobile",
+        "tran_code": 1,
+        "mcc": 5411,
+        "client_id": 1,
+        "card_type": "visa",
+        "pin_inc_count": 0,
+        "card_status": "active",
+        "datetime": "2024-01-01T00:00:00",
+        "sum": float(index),
+        "oper_type": "purchase",
+        "expiration_date": "2025-01-01",
+        "balance": 100.0,
+    }
+
+
+async def split_stream(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+async def test_ndjson_chunks_split_lines_across_network_chunks():
+    body = b'{"a": 1}\n\n{"a": 2}\n{"a": 3}'
+    chunks = [chunk async for chunk in ndjson_chunks(split_stream(body, 3), chunk_size=2)]
+    assert chunks == [[{"a": 1}, {"a": 2}], [{"a": 3}]]
+
+
+async def test_predict_stream_returns_row_per_line():
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[Container.model_client] = FakeModel
+
+    lines = [json.dumps(make_record(index)) for index in range(7)] + ["{broken"]
+    body = "\n".join(lines).encode("utf-8")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/predict/stream?chunk_size=3", content=split_stream(body, 50))
+
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert response.status_code == 200
+    assert [item["pred"] for item in items[:7]] == [float(index) for index in range(7)]
+    assert items[7]["pred"] is None and items[7]["error"].startswith("Некорректная строка NDJSON")
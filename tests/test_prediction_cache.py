@@ -0,0 +1,80 @@
+import os
+import shutil
+
+import joblib
+import pytest
+
+from app.api.models.predict import PredictIn
+from app.workers.model_registry import ModelRegistry
+from app.workers.model_scorer import load_sample
+from app.workers.prediction_cache import PredictionCache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+MODEL_PATH = "config/model.pkl"
+SAMPLE_PATH = "config/model_sample.json"
+
+pytestmark = pytest.mark.skipif(not os.path.exists(MODEL_PATH), reason="Нет файла модели config/model.pkl")
+
+
+@pytest.fixture
+def model_path(tmp_path) -> str:
+    path = tmp_path / "model.pkl"
+    shutil.copyfile(MODEL_PATH, path)
+    return str(path)
+
+
+@pytest.fixture
+def records() -> list[dict]:
+    return load_sample(SAMPLE_PATH)
+
+
+@pytest.fixture
+def registry(model_path) -> ModelRegistry:
+    return ModelRegistry(default_path=model_path)
+
+
+@pytest.fixture
+def prediction_cache(registry) -> PredictionCache:
+    cache = PredictionCache(fakeredis.FakeAsyncRedis(), local_maxsize=100)
+    cache.activate(registry.active)
+    registry.swap_callbacks.append(cache.swap)
+    return cache
+
+
+async def test_cached_predictions_are_returned(registry, prediction_cache, records):
+    predictions = registry.active.predict_batch(records)
+    await prediction_cache.set_many(records, predictions)
+    assert await prediction_cache.get_many(records) == predictions
+
+
+async def test_same_named_model_replacement_misses(registry, prediction_cache, model_path, records):
+    await prediction_cache.set_many(records, registry.active.predict_batch(records))
+    version = registry.active.version
+
+    # Та же модель, пересохранённая со сжатием: имя файла прежнее, содержимое другое
+    replacement = f"{model_path}.new"
+    joblib.dump(joblib.load(model_path), replacement, compress=3)
+    os.replace(replacement, model_path)
+    await registry.refresh()
+
+    assert registry.active.version != version
+    assert prediction_cache.version == registry.active.version
+    assert await prediction_cache.get_many(records) == [None] * len(records)
+
+
+async def test_digest_ignores_record_format(registry, prediction_cache, records):
+    # Из очереди приходит id и даты строками, из HTTP - record_id и datetime/date после PredictIn
+    queue_record = records[0]
+    http_record = PredictIn.model_validate({**queue_record, "record_id": queue_record["id"]}).model_dump()
+    [prediction] = registry.active.predict_batch([queue_record])
+    await prediction_cache.set_many([queue_record], [prediction])
+
+    assert prediction_cache.digest(http_record) == prediction_cache.digest(queue_record)
+    assert await prediction_cache.get_many([http_record]) == [prediction]
+
+
+async def test_changed_features_miss(registry, prediction_cache, records):
+    record = records[0]
+    await prediction_cache.set_many([record], registry.active.predict_batch([record]))
+    assert await prediction_cache.get_many([{**record, "sum": record["sum"] + 1}]) == [None]
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app.helpers.codecs import MsgpackCodec
+from app.helpers.redis import RedisRetryQueue
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("msgpack")
+
+ROUTING_KEY = "model_manager_routing_key"
+
+
+class FakeAmqp:
+    def __init__(self):
+        self.sent: list = []
+
+    async def send(self, message, routing_key: str, **kwargs) -> None:
+        self.sent.append((message, routing_key))
+
+
+@pytest.fixture
+def amqp() -> FakeAmqp:
+    return FakeAmqp()
+
+
+@pytest.fixture
+def retry_queue(amqp) -> RedisRetryQueue:
+    return RedisRetryQueue(
+        fakeredis.FakeAsyncRedis(decode_responses=True), amqp, max_attempts=2, base_delay=0, codec=MsgpackCodec()
+    )
+
+
+async def test_bytes_message_is_requeued_unchanged(retry_queue, amqp):
+    message = MsgpackCodec().dumps({"id": 1, "sum": 10.5}) + b"\xff\x00"
+    await retry_queue.fail(ROUTING_KEY, message, ValueError("boom"))
+    assert await retry_queue.requeue_due(ROUTING_KEY) == 1
+    assert amqp.sent == [(message, ROUTING_KEY)]
+
+
+async def test_dict_message_is_requeued_with_codec(retry_queue, amqp):
+    message = {"id": 1, "sum": 10.5}
+    await retry_queue.fail(ROUTING_KEY, message, ValueError("boom"))
+    await retry_queue.requeue_due(ROUTING_KEY)
+    assert amqp.sent == [(MsgpackCodec().dumps(message), ROUTING_KEY)]
+
+
+async def test_bytes_dead_letter_is_listed_and_replayed(retry_queue, amqp):
+    decodable = MsgpackCodec().dumps({"id": 2})
+    broken = b"\xc1 not msgpack"
+    for message in (decodable, broken):
+        await retry_queue.fail(ROUTING_KEY, message, ValueError("boom"))
+        await retry_queue.fail(ROUTING_KEY, message, ValueError("boom"))
+
+    dead_letters = await retry_queue.dead_letters(ROUTING_KEY)
+    assert [item["message"] for item in dead_letters] == [{"id": 2}, broken.decode("utf-8", "replace")]
+    assert [item["attempts"] for item in dead_letters] == [2, 2]
+
+    assert await retry_queue.replay(ROUTING_KEY) == 2
+    assert amqp.sent == [(decodable, ROUTING_KEY), (broken, ROUTING_KEY)]
+    assert await retry_queue.dead_letters_count(ROUTING_KEY) == 0
+
+
+async def test_legacy_envelope_is_requeued(retry_queue, amqp):
+    envelope = json.dumps({"message": {"id": 3}, "attempts": 1, "error": "ValueError()", "failed_at": 0})
+    await retry_queue.redis.zadd(retry_queue.delayed_key(ROUTING_KEY), {envelope: 0})
+    await retry_queue.requeue_due(ROUTING_KEY)
+    assert amqp.sent == [({"id": 3}, ROUTING_KEY)]